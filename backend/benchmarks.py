@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the model and serialization hot paths of server.py.
+
+Every write path runs ``prepare_for_mongo(model.dict())`` and every read path
+runs ``Model(**doc)``; these benchmarks time them, along with JWT handling and
+response encoding, at several bill sizes.
+
+    python benchmarks.py --output before.json
+    python benchmarks.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import timeit
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmarks')
+# The prepare_for_mongo_dict benchmark deliberately times the deprecated .dict()
+warnings.simplefilter("ignore")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import pydantic
+import server
+
+ROOT_DIR = Path(__file__).parent
+SIZES = [1, 10, 100]
+RESPONSE_BILLS = 100
+
+
+def make_bill(items: int) -> server.Bill:
+    return server.Bill(
+        bill_number="INF-00001",
+        customer_id="customer-id",
+        customer_name="Amal Perera",
+        customer_contact="0771234567",
+        items=[server.BillItem(
+            product_id=f"product-{i}",
+            product_name=f"Product {i}",
+            quantity=2,
+            price=450.0,
+            subtotal=900.0
+        ) for i in range(items)],
+        total=900.0 * items
+    )
+
+
+def item_payloads(items: int):
+    return [{"product_id": f"product-{i}", "product_name": f"Product {i}", "quantity": 2, "price": 450.0, "subtotal": 900.0}
+            for i in range(items)]
+
+
+# Each benchmark takes a size and returns the zero-argument callable to time
+def bench_bill_construction(size):
+    items = item_payloads(size)
+    return lambda: server.Bill(
+        bill_number="INF-00001",
+        customer_id="customer-id",
+        customer_name="Amal Perera",
+        customer_contact="0771234567",
+        items=[server.BillItem(**item) for item in items],
+        total=900.0 * size
+    )
+
+
+def bench_prepare_for_mongo_dict(size):
+    bill = make_bill(size)
+    return lambda: server.prepare_for_mongo(bill.dict())
+
+
+def bench_prepare_for_mongo_model_dump(size):
+    bill = make_bill(size)
+    return lambda: server.prepare_for_mongo(bill.model_dump())
+
+
+def bench_bill_from_document(size):
+    doc = server.prepare_for_mongo(make_bill(size).model_dump())
+    return lambda: server.Bill(**doc)
+
+
+def bench_bill_model_validate(size):
+    doc = server.prepare_for_mongo(make_bill(size).model_dump())
+    return lambda: server.Bill.model_validate(doc)
+
+
+def bench_response_encoding(size):
+    bills = [make_bill(size) for _ in range(RESPONSE_BILLS)]
+    return lambda: JSONResponse(jsonable_encoder(bills)).body
+
+
+def bench_jwt_encode(size):
+    return lambda: server.create_access_token(data={"sub": "admin"})
+
+
+def bench_jwt_decode(size):
+    token = server.create_access_token(data={"sub": "admin"})
+    return lambda: server.jwt.decode(token, server.JWT_SECRET, algorithms=[server.JWT_ALGORITHM])
+
+
+BENCHMARKS = {
+    "bill_construction": (bench_bill_construction, SIZES),
+    "prepare_for_mongo_dict": (bench_prepare_for_mongo_dict, SIZES),
+    "prepare_for_mongo_model_dump": (bench_prepare_for_mongo_model_dump, SIZES),
+    "bill_from_document": (bench_bill_from_document, SIZES),
+    "bill_model_validate": (bench_bill_model_validate, SIZES),
+    "response_encoding": (bench_response_encoding, SIZES),
+    "jwt_encode": (bench_jwt_encode, [None]),
+    "jwt_decode": (bench_jwt_decode, [None]),
+}
+
+
+def run_benchmark(fn, repeat, min_time):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    timings = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "number": number,
+        "min_us": round(min(timings) * 1e6, 3),
+        "median_us": round(statistics.median(timings) * 1e6, 3),
+        "stdev_us": round(statistics.stdev(timings) * 1e6, 3) if len(timings) > 1 else 0.0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, repeat, min_time):
+    results = {}
+    for name in names:
+        factory, sizes = BENCHMARKS[name]
+        for size in sizes:
+            key = name if size is None else f"{name}[items={size}]"
+            results[key] = run_benchmark(factory(size), repeat, min_time)
+            print(f"{key:<45}{results[key]['median_us']:>14.2f} us")
+    return {
+        "metadata": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pydantic": pydantic.VERSION,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline):
+    print(f"\n{'Benchmark':<45}{'baseline us':>14}{'current us':>14}{'change':>10}")
+    for key, result in current["results"].items():
+        previous = baseline["results"].get(key)
+        if previous is None:
+            continue
+        change = result["median_us"] / previous["median_us"] - 1
+        print(f"{key:<45}{previous['median_us']:>14.2f}{result['median_us']:>14.2f}{change:>+10.1%}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Approximate seconds per repeat")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Compare against a previous JSON results file")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run(args.benchmarks or list(BENCHMARKS), args.repeat, args.min_time)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text()))
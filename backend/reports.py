@@ -0,0 +1,204 @@
+"""CPU-bound report rendering steps.
+
+These run in the background job process pool, so they only take and return
+plain, picklable data.
+"""
+
+import csv
+import html
+import io
+from datetime import datetime
+
+from fpdf import FPDF
+
+BILL_EXPORT_COLUMNS = [
+    "bill_number", "date", "customer_name", "customer_contact",
+    "product_name", "quantity", "price", "subtotal", "bill_total",
+]
+
+
+def render_bills_csv(bills: list, include_header: bool = False) -> str:
+    """Render bills as CSV text with one row per bill item"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if include_header:
+        writer.writerow(BILL_EXPORT_COLUMNS)
+    for bill in bills:
+        for item in bill.get("items", []):
+            writer.writerow([
+                bill.get("bill_number"),
+                bill.get("date"),
+                bill.get("customer_name"),
+                bill.get("customer_contact"),
+                item.get("product_name"),
+                item.get("quantity"),
+                item.get("price"),
+                item.get("subtotal"),
+                bill.get("total"),
+            ])
+    return buffer.getvalue()
+
+
+# Bump whenever receipt output changes; cached receipts are keyed by it
+RECEIPT_TEMPLATE_VERSION = 1
+RECEIPT_FORMATS = {"html": "text/html; charset=utf-8", "pdf": "application/pdf"}
+
+SHOP_NAME = "INFINITY BOOKSHOP"
+SHOP_TAGLINE = "Educational Books & Stationery"
+SHOP_CONTACT = "Contact: +94 11 234 5678 | Email: info@infinitybookshop.lk"
+SHOP_ADDRESS = "Address: 123 Education Lane, Colombo 07, Sri Lanka"
+CURRENCY = "Rs."
+
+RECEIPT_STYLE = """
+body { font-family: Arial, sans-serif; margin: 20px; color: #333; }
+.invoice-header { text-align: center; border-bottom: 3px solid #007bff; padding-bottom: 20px; margin-bottom: 30px; }
+.company-name { font-size: 32px; font-weight: bold; color: #007bff; margin-bottom: 5px; }
+.company-tagline { color: #666; font-size: 16px; margin-bottom: 10px; }
+.company-contact { color: #666; font-size: 14px; }
+.details { display: flex; gap: 40px; }
+.details h4 { color: #007bff; border-bottom: 2px solid #e9ecef; padding-bottom: 10px; margin-bottom: 15px; }
+.info-row { margin-bottom: 8px; }
+.info-label { font-weight: bold; display: inline-block; width: 120px; }
+table { width: 100%; border-collapse: collapse; margin: 30px 0; font-size: 14px; }
+th { background-color: #007bff; color: white; padding: 12px 8px; text-align: left; font-weight: 600; }
+td { border-bottom: 1px solid #dee2e6; padding: 10px 8px; }
+.text-right { text-align: right; }
+.text-center { text-align: center; }
+.total-row td { font-weight: bold; font-size: 16px; background-color: #f8f9fa; border-top: 2px solid #007bff; padding: 15px 8px; }
+.invoice-footer { margin-top: 40px; text-align: center; border-top: 2px solid #e9ecef; padding-top: 20px; color: #666; }
+.thank-you { font-size: 18px; color: #007bff; font-weight: 600; margin-bottom: 10px; }
+@media print { body { margin: 0; } .no-print { display: none !important; } }
+.print-btn { position: fixed; top: 20px; right: 20px; }
+"""
+
+
+def format_currency(amount) -> str:
+    return f"{CURRENCY} {amount:,.2f}"
+
+
+def _bill_date(bill: dict) -> datetime:
+    date = bill["date"]
+    return date if isinstance(date, datetime) else datetime.fromisoformat(date)
+
+
+def render_receipt_html(bill: dict) -> str:
+    """Printable HTML receipt, laid out like print_bill.php"""
+    date = _bill_date(bill)
+    rows = "".join(
+        f"<tr><td class=\"text-center\">{number}</td>"
+        f"<td>{html.escape(item['product_name'])}</td>"
+        f"<td class=\"text-center\">{item['quantity']}</td>"
+        f"<td class=\"text-right\">{format_currency(item['price'])}</td>"
+        f"<td class=\"text-right\">{format_currency(item['subtotal'])}</td></tr>"
+        for number, item in enumerate(bill["items"], start=1)
+    )
+    bill_number = html.escape(bill["bill_number"])
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<title>Invoice - {bill_number}</title>
+<style>{RECEIPT_STYLE}</style>
+</head>
+<body>
+<button class="no-print print-btn" onclick="window.print()">Print Invoice</button>
+<div class="invoice-header">
+<div class="company-name">{SHOP_NAME}</div>
+<div class="company-tagline">{html.escape(SHOP_TAGLINE)}</div>
+<div class="company-contact">{SHOP_CONTACT}<br>{SHOP_ADDRESS}</div>
+</div>
+<div class="details">
+<div>
+<h4>INVOICE DETAILS</h4>
+<div class="info-row"><span class="info-label">Invoice Number:</span><strong>{bill_number}</strong></div>
+<div class="info-row"><span class="info-label">Date:</span>{date:%B %d, %Y}</div>
+<div class="info-row"><span class="info-label">Time:</span>{date:%I:%M %p}</div>
+</div>
+<div>
+<h4>BILL TO</h4>
+<div class="info-row"><span class="info-label">Name:</span><strong>{html.escape(bill["customer_name"])}</strong></div>
+<div class="info-row"><span class="info-label">Contact:</span>{html.escape(bill["customer_contact"])}</div>
+</div>
+</div>
+<table>
+<thead><tr><th style="width: 5%;">#</th><th style="width: 45%;">Item Description</th><th style="width: 15%;" class="text-center">Quantity</th><th style="width: 17.5%;" class="text-right">Unit Price</th><th style="width: 17.5%;" class="text-right">Total</th></tr></thead>
+<tbody>{rows}</tbody>
+<tfoot><tr class="total-row"><td colspan="4" class="text-right">TOTAL AMOUNT:</td><td class="text-right">{format_currency(bill["total"])}</td></tr></tfoot>
+</table>
+<div class="invoice-footer">
+<div class="thank-you">Thank you for your business!</div>
+<p><em>This is a computer generated invoice and does not require a signature.</em></p>
+<p><small>For any queries regarding this invoice, please contact us at +94 11 234 5678</small></p>
+</div>
+</body>
+</html>
+"""
+
+
+def _latin1(text: str) -> str:
+    # The built-in PDF fonts only cover Latin-1
+    return text.encode("latin-1", "replace").decode("latin-1")
+
+
+def render_receipt_pdf(bill: dict) -> bytes:
+    """A4 PDF receipt with the same content as the HTML one"""
+    date = _bill_date(bill)
+    pdf = FPDF(format="A4")
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 22)
+    pdf.set_text_color(0, 123, 255)
+    pdf.cell(0, 12, SHOP_NAME, align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", "", 11)
+    pdf.set_text_color(102, 102, 102)
+    for line in (SHOP_TAGLINE, SHOP_CONTACT, SHOP_ADDRESS):
+        pdf.cell(0, 6, line, align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(6)
+
+    pdf.set_text_color(51, 51, 51)
+    for label, value in (
+        ("Invoice Number:", bill["bill_number"]),
+        ("Date:", f"{date:%B %d, %Y}"),
+        ("Time:", f"{date:%I:%M %p}"),
+        ("Bill To:", bill["customer_name"]),
+        ("Contact:", bill["customer_contact"]),
+    ):
+        pdf.set_font("Helvetica", "B", 11)
+        pdf.cell(40, 7, label)
+        pdf.set_font("Helvetica", "", 11)
+        pdf.cell(0, 7, _latin1(value), new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(6)
+
+    widths = (10, 85, 25, 35, 35)
+    pdf.set_font("Helvetica", "B", 10)
+    pdf.set_fill_color(0, 123, 255)
+    pdf.set_text_color(255, 255, 255)
+    for width, heading, align in zip(widths, ("#", "Item Description", "Quantity", "Unit Price", "Total"), "LLCRR"):
+        pdf.cell(width, 9, heading, align=align, fill=True)
+    pdf.ln()
+    pdf.set_font("Helvetica", "", 10)
+    pdf.set_text_color(51, 51, 51)
+    for number, item in enumerate(bill["items"], start=1):
+        values = (str(number), _latin1(item["product_name"]), str(item["quantity"]),
+                  format_currency(item["price"]), format_currency(item["subtotal"]))
+        for width, value, align in zip(widths, values, "CLCRR"):
+            pdf.cell(width, 8, value, border="B", align=align)
+        pdf.ln()
+    pdf.set_font("Helvetica", "B", 12)
+    pdf.cell(sum(widths[:4]), 11, "TOTAL AMOUNT:", border="T", align="R")
+    pdf.cell(widths[4], 11, format_currency(bill["total"]), border="T", align="R", new_x="LMARGIN", new_y="NEXT")
+
+    pdf.ln(12)
+    pdf.set_font("Helvetica", "B", 13)
+    pdf.set_text_color(0, 123, 255)
+    pdf.cell(0, 8, "Thank you for your business!", align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", "I", 9)
+    pdf.set_text_color(102, 102, 102)
+    pdf.cell(0, 6, "This is a computer generated invoice and does not require a signature.", align="C")
+    return bytes(pdf.output())
+
+
+def render_receipt(bill: dict, format: str) -> bytes:
+    if format == "pdf":
+        return render_receipt_pdf(bill)
+    return render_receipt_html(bill).encode("utf-8")
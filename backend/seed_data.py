@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset seeder for scale testing.
+
+Generates a deterministic catalogue, customer base and bill history from a
+fixed seed and bulk-loads it with concurrent, chunked insert_many calls.
+Documents have the same shape as the ones written by the API, including the
+branch they belong to, so the API's startup backfill has nothing to do.
+
+    python seed_data.py --products 100000 --customers 500000 --bills 5000000 --drop
+
+Further branches reuse the shared categories and customers:
+
+    python seed_data.py --branch kandy --branch-only --bills 1000000
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import bcrypt
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Must match the API's DEFAULT_BRANCH
+DEFAULT_BRANCH = os.environ.get('DEFAULT_BRANCH', 'main')
+
+# What the API derives from the seeded collections. --drop clears these too,
+# or they would describe products and bills that are gone, or that the reseed
+# recreates under the same ids. Branch-scoped ones are cleared per branch; the
+# shared ones are dropped and the API rebuilds them from what remains.
+BRANCH_DERIVED_COLLECTIONS = ("bill_archive", "holds", "stock_movements")
+SHARED_DERIVED_COLLECTIONS = ("receipts", "stock_snapshots", "stock_snapshot_runs", "reorder_suggestions", "forecast_runs")
+# Must match the API's bill_archive_partition()
+BILL_ARCHIVE_PARTITION_PREFIX = "bills_archive_"
+
+FIRST_NAMES = ["Amal", "Nimal", "Kamala", "Sunil", "Priya", "Ruwan", "Dilani", "Kasun", "Chamari", "Tharindu",
+               "Sanduni", "Mahesh", "Ishara", "Lahiru", "Nadeesha", "Saman", "Hiruni", "Pradeep", "Anjali", "Dinesh"]
+LAST_NAMES = ["Perera", "Silva", "Jayawardena", "Fernando", "Rajapaksa", "Bandara", "Wickramasinghe", "Dissanayake",
+              "Gunawardena", "Herath", "Kumara", "Ranasinghe", "Senanayake", "Weerasinghe", "Karunaratne"]
+STREETS = ["Main Street", "Galle Road", "Kandy Road", "High Level Road", "Temple Road", "Station Road", "Lake Drive"]
+CITIES = ["Colombo 07", "Dehiwala", "Peradeniya", "Nugegoda", "Mount Lavinia", "Kandy", "Galle", "Negombo"]
+CATEGORY_NAMES = ["School Books", "Stationery", "Educational Materials", "Art Supplies", "Novels", "Children's Books",
+                  "Reference", "Exam Papers", "Office Supplies", "Magazines"]
+PRODUCT_WORDS = ["Mathematics", "Science", "English", "History", "Geography", "Sinhala", "Tamil", "ICT", "Art",
+                 "Notebook", "Pen", "Pencil", "Ruler", "Atlas", "Workbook", "Guide", "Reader", "Dictionary"]
+
+# Most bills have one to three items, a few are bulk purchases
+ITEM_COUNTS = [1, 2, 3, 4, 5, 6, 8, 12]
+ITEM_COUNT_WEIGHTS = [40, 25, 15, 8, 5, 3, 2, 2]
+# Shop hours weighting, 08:00 - 19:00 local trading day
+HOUR_WEIGHTS = [1, 3, 5, 6, 6, 7, 6, 5, 5, 6, 4, 2]
+
+
+def stable_id(seed: int, kind: str, index: int) -> str:
+    """Deterministic UUID so that bills can reference products and customers by index"""
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f"{seed}:{kind}:{index}"))
+
+
+def bill_sequence(branch_id: str) -> str:
+    # Same counter names and bill number format as the API
+    return "bill_number" if branch_id == DEFAULT_BRANCH else f"bill_number:{branch_id}"
+
+
+def bill_number_prefix(branch_id: str) -> str:
+    return "INF-" if branch_id == DEFAULT_BRANCH else f"INF-{branch_id.upper()}-"
+
+
+def chunk_rng(seed: int, kind: str, chunk: int) -> random.Random:
+    # One generator per chunk keeps output identical however chunks are scheduled
+    return random.Random(f"{seed}:{kind}:{chunk}")
+
+
+class DatasetGenerator:
+    def __init__(self, seed, categories, products, customers, bills, days, end, branch_id=DEFAULT_BRANCH):
+        self.seed = seed
+        self.branch_id = branch_id
+        # Categories and customers are shared; each branch has its own
+        # products and bills, so their ids must not collide across branches
+        self.branch_seed = seed if branch_id == DEFAULT_BRANCH else f"{seed}:{branch_id}"
+        self.category_count = categories
+        self.product_count = products
+        self.customer_count = customers
+        self.bill_count = bills
+        self.days = days
+        self.end = end
+        self.created_at = self.end.isoformat()
+
+        rng = random.Random(f"{seed}:catalogue")
+        self.category_names = [
+            CATEGORY_NAMES[i] if i < len(CATEGORY_NAMES) else f"{CATEGORY_NAMES[i % len(CATEGORY_NAMES)]} {i // len(CATEGORY_NAMES)}"
+            for i in range(categories)
+        ]
+        self.product_prices = [round(rng.uniform(50, 5000), -1) for _ in range(products)]
+        self.product_categories = [rng.randrange(categories) for _ in range(products)]
+        # Zipf-like popularity: a small share of the catalogue makes most of the sales
+        self.product_popularity = list(itertools.accumulate(1 / (rank + 1) for rank in range(products)))
+        self.product_order = list(range(products))
+        rng.shuffle(self.product_order)
+        # Bill items repeat product ids and names millions of times
+        self.product_ids = [stable_id(self.branch_seed, "product", i) for i in range(products)]
+        self.product_names = [self.product_name(i) for i in range(products)]
+
+    def product_name(self, index: int) -> str:
+        first = PRODUCT_WORDS[index % len(PRODUCT_WORDS)]
+        second = PRODUCT_WORDS[(index // len(PRODUCT_WORDS)) % len(PRODUCT_WORDS)]
+        return f"{first} {second} #{index}"
+
+    def customer_name(self, index: int) -> str:
+        return f"{FIRST_NAMES[index % len(FIRST_NAMES)]} {LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]}"
+
+    def customer_contact(self, index: int) -> str:
+        return f"07{index:08d}"
+
+    def categories(self):
+        return [{
+            "id": stable_id(self.seed, "category", i),
+            "name": name,
+            "description": f"{name} section",
+            "created_at": self.created_at,
+        } for i, name in enumerate(self.category_names)]
+
+    def products(self, start, stop, chunk):
+        rng = chunk_rng(self.seed, "products", chunk)
+        return [{
+            "id": self.product_ids[i],
+            "name": self.product_names[i],
+            "category_id": stable_id(self.seed, "category", self.product_categories[i]),
+            "category_name": self.category_names[self.product_categories[i]],
+            "price": self.product_prices[i],
+            "quantity": rng.randint(0, 500),
+            "image_url": "",
+            "description": f"Synthetic product {i}",
+            "branch_id": self.branch_id,
+            "created_at": self.created_at,
+        } for i in range(start, stop)]
+
+    def customers(self, start, stop, chunk):
+        rng = chunk_rng(self.seed, "customers", chunk)
+        return [{
+            "id": stable_id(self.seed, "customer", i),
+            "name": self.customer_name(i),
+            "contact": self.customer_contact(i),
+            "email": f"customer{i}@example.com",
+            "address": f"{rng.randint(1, 999)} {rng.choice(STREETS)}, {rng.choice(CITIES)}",
+            "created_at": self.created_at,
+        } for i in range(start, stop)]
+
+    def bills(self, start, stop, chunk):
+        rng = chunk_rng(self.seed, "bills", chunk)
+        span = self.bill_count or 1
+        docs = []
+        prefix = bill_number_prefix(self.branch_id)
+        for i in range(start, stop):
+            customer = rng.randrange(self.customer_count)
+            # Bill numbers increase with time, like the ones issued by the API
+            day = self.end - timedelta(days=self.days * (span - i) / span)
+            bill_date = day.replace(hour=8 + rng.choices(range(12), weights=HOUR_WEIGHTS)[0],
+                               minute=rng.randrange(60), second=rng.randrange(60))
+            count = min(rng.choices(ITEM_COUNTS, weights=ITEM_COUNT_WEIGHTS)[0], self.product_count)
+            picks = rng.choices(self.product_order, cum_weights=self.product_popularity, k=count)
+            items = []
+            total = 0.0
+            for product in dict.fromkeys(picks):
+                quantity = rng.choices((1, 2, 3, 5, 10), weights=(70, 15, 8, 5, 2))[0]
+                price = self.product_prices[product]
+                subtotal = price * quantity
+                total += subtotal
+                items.append({
+                    "product_id": self.product_ids[product],
+                    "product_name": self.product_names[product],
+                    "quantity": quantity,
+                    "price": price,
+                    "subtotal": subtotal,
+                })
+            docs.append({
+                "id": stable_id(self.branch_seed, "bill", i),
+                "bill_number": f"{prefix}{i + 1:05d}",
+                "customer_id": stable_id(self.seed, "customer", customer),
+                "customer_name": self.customer_name(customer),
+                "customer_contact": self.customer_contact(customer),
+                "date": bill_date.isoformat(),
+                "items": items,
+                "total": total,
+                "branch_id": self.branch_id,
+                "created_at": bill_date.isoformat(),
+            })
+        return docs
+
+
+async def load_collection(collection, generate, count, chunk_size, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    inserted = 0
+    started = time.perf_counter()
+
+    async def insert(docs):
+        nonlocal inserted
+        try:
+            await collection.insert_many(docs, ordered=False)
+        finally:
+            semaphore.release()
+        inserted += len(docs)
+
+    tasks = []
+    for chunk, start in enumerate(range(0, count, chunk_size)):
+        # Wait for a free slot before generating, so at most `concurrency`
+        # chunks are held in memory at once
+        await semaphore.acquire()
+        docs = generate(start, min(start + chunk_size, count), chunk)
+        tasks.append(asyncio.create_task(insert(docs)))
+    await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - started
+    print(f"{collection.name}: {inserted} documents in {elapsed:.1f}s ({inserted / max(elapsed, 1e-9):,.0f}/s)")
+
+
+async def seed(args):
+    client = AsyncIOMotorClient(args.mongo_url, maxPoolSize=max(args.concurrency, 10))
+    db = client[args.db_name]
+    end = datetime.combine(args.end_date, datetime.min.time(), tzinfo=timezone.utc)
+    generator = DatasetGenerator(args.seed, args.categories, args.products, args.customers, args.bills, args.days, end,
+                                 args.branch)
+    # The API's login for the branch; other branches get their own admin
+    username = "admin" if args.branch == DEFAULT_BRANCH else f"admin_{args.branch}"
+    try:
+        if args.drop:
+            partitions = [name for name in await db.list_collection_names() if name.startswith(BILL_ARCHIVE_PARTITION_PREFIX)]
+            for name in SHARED_DERIVED_COLLECTIONS:
+                await db[name].drop()
+        if args.drop and args.branch_only:
+            for name in ("users", "products", "bills", *BRANCH_DERIVED_COLLECTIONS, *partitions):
+                await db[name].delete_many({"branch_id": args.branch})
+            await db.counters.delete_one({"_id": bill_sequence(args.branch)})
+        elif args.drop:
+            for name in ("users", "categories", "products", "customers", "bills", *BRANCH_DERIVED_COLLECTIONS, *partitions):
+                await db[name].drop()
+            # Every branch's bill numbers start over with the bills; the other
+            # counters (the cache bus) belong to the running API
+            await db.counters.delete_many({"_id": {"$regex": f"^{bill_sequence(DEFAULT_BRANCH)}(:|$)"}})
+
+        if not await db.users.find_one({"username": username}):
+            await db.users.insert_one({
+                "id": stable_id(generator.branch_seed, "user", 0),
+                "username": username,
+                "password": bcrypt.hashpw(b"admin123", bcrypt.gensalt()).decode('utf-8'),
+                "branch_id": args.branch,
+                "created_at": generator.created_at,
+            })
+        if not args.branch_only:
+            await db.categories.insert_many(generator.categories())
+        await load_collection(db.products, generator.products, args.products, args.chunk_size, args.concurrency)
+        if not args.branch_only:
+            await load_collection(db.customers, generator.customers, args.customers, args.chunk_size, args.concurrency)
+        await load_collection(db.bills, generator.bills, args.bills, args.chunk_size, args.concurrency)
+        # Bills issued by the API continue after the seeded numbers
+        await db.counters.update_one({"_id": bill_sequence(args.branch)}, {"$max": {"seq": args.bills}}, upsert=True)
+    finally:
+        client.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    parser.add_argument("--db-name", default=os.environ.get('DB_NAME', 'infinity_bookshop'))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--customers", type=int, default=500_000)
+    parser.add_argument("--bills", type=int, default=5_000_000)
+    parser.add_argument("--days", type=int, default=730, help="Spread bill dates over this many days")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date.today(),
+                        help="Last day of bill history (YYYY-MM-DD); fix it for byte-identical datasets")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent insert_many batches")
+    parser.add_argument("--drop", action="store_true",
+                        help="Drop the seeded collections and what the API derived from them first")
+    parser.add_argument("--branch", default=DEFAULT_BRANCH, help="Branch the products, bills and admin user belong to")
+    parser.add_argument("--branch-only", action="store_true",
+                        help="Skip the shared categories and customers, which an earlier run already seeded")
+    args = parser.parse_args()
+    if args.products < 1 or args.customers < 1 or args.categories < 1:
+        parser.error("--categories, --products and --customers must be at least 1")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(seed(parse_args()))
@@ -1,12 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, status, Depends, Header, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse, FileResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring, CursorType, ReturnDocument, UpdateOne, ReplaceOne
+from pymongo.errors import CollectionInvalid, BulkWriteError, DuplicateKeyError
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST
 import os
+import re
+import math
+import time
+import json
+import random
+import asyncio
+import socket
+import ipaddress
 import logging
+import contextvars
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from contextlib import asynccontextmanager
+from collections import deque, OrderedDict
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
@@ -14,43 +31,1013 @@ from datetime import datetime, timezone
 import bcrypt
 import jwt
 from datetime import timedelta
+from functools import partial
+import pandas as pd
+from forecasting import compute_reorder_suggestions
+from reports import render_bills_csv, render_receipt, RECEIPT_FORMATS, RECEIPT_TEMPLATE_VERSION
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics: each worker process keeps its own values. With several workers,
+# set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by them (and
+# cleared before they start) so /metrics aggregates every live worker.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route and status",
+    ["method", "route", "status"],
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency by collection and operation",
+    ["collection", "command", "outcome"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongo_pool_connections",
+    "Open connections in the MongoDB connection pool",
+    ["address"],
+    multiprocess_mode="livesum",
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongo_pool_checked_out_connections",
+    "Connections currently checked out of the MongoDB connection pool",
+    ["address"],
+    multiprocess_mode="livesum",
+)
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds",
+    "Delay between the scheduled and actual wakeup of the event loop probe",
+    multiprocess_mode="livemax",
+)
+EVENT_LOOP_PROBE_INTERVAL = 0.5
+LOGIN_ATTEMPTS_REJECTED = Counter(
+    "login_attempts_rejected_total",
+    "Rejected login and password change attempts by reason",
+    ["reason"],
+)
+
+def _command_collection(command_name: str, command) -> str:
+    if command_name == "getMore":
+        return str(command.get("collection", ""))
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        self._collections[(event.connection_id, event.request_id)] = _command_collection(event.command_name, event.command)
+
+    def _observe(self, event, outcome):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_DURATION.labels(collection, event.command_name, outcome).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._observe(event, "ok")
+
+    def failed(self, event):
+        self._observe(event, "error")
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    def _address(self, event):
+        return "%s:%s" % event.address
+
+    def pool_created(self, event):
+        MONGO_POOL_CONNECTIONS.labels(self._address(event)).set(0)
+        MONGO_POOL_CHECKED_OUT.labels(self._address(event)).set(0)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        MONGO_POOL_CONNECTIONS.labels(self._address(event)).set(0)
+        MONGO_POOL_CHECKED_OUT.labels(self._address(event)).set(0)
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.labels(self._address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.labels(self._address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.labels(self._address(event)).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.labels(self._address(event)).dec()
+
+# ASGI scope of the request being handled. Motor runs driver calls in a copy of
+# the caller's context, so command listeners can see which route issued them.
+current_request = contextvars.ContextVar("current_request", default=None)
+
+def current_route() -> str:
+    scope = current_request.get()
+    if scope is None:
+        return ""
+    route = scope.get("route")
+    return route.path if route is not None else scope["path"]
+
+class RequestMetricsMiddleware:
+    """Record per-route latency; the route template keeps label cardinality bounded"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        token = current_request.set(scope)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"],
+                route.path if route is not None else "<unmatched>",
+                str(status_code),
+            ).observe(time.perf_counter() - start)
+
+async def monitor_event_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(EVENT_LOOP_PROBE_INTERVAL)
+        EVENT_LOOP_LAG.set(max(0.0, loop.time() - start - EVENT_LOOP_PROBE_INTERVAL))
+
+# Slow query log
+slow_query_logger = logging.getLogger("server.slow_query")
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+
+def redact_filter(value):
+    """Keep the shape of a query (field names and operators) but drop the values"""
+    if isinstance(value, dict):
+        return {key: redact_filter(item) for key, item in value.items()}
+    if isinstance(value, list):
+        shapes = []
+        for item in value:
+            shape = redact_filter(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+def _command_filter(command_name: str, command):
+    if command_name == "find":
+        return command.get("filter", {})
+    if command_name == "aggregate":
+        return command.get("pipeline", [])
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query", {})
+    if command_name == "update":
+        return [update.get("q", {}) for update in command.get("updates", [])]
+    if command_name == "delete":
+        return [delete.get("q", {}) for delete in command.get("deletes", [])]
+    return None
+
+def _plan_stages(plan) -> list:
+    stages = []
+    while plan:
+        stage = {"stage": plan.get("stage")}
+        if "indexName" in plan:
+            stage["index"] = plan["indexName"]
+        stages.append(stage)
+        inputs = plan.get("inputStages") or [plan.get("inputStage")]
+        plan = inputs[0]
+    return stages
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Log Mongo commands slower than a threshold together with their query plan.
+
+    The listener runs on driver threads, so slow commands are handed to an
+    asyncio worker which runs ``explain`` and writes the log record. Settings
+    changed at runtime are stored in the ``settings`` collection so that every
+    worker applies the same ones.
+    """
+    SETTINGS_ID = "slow_query_log"
+    SETTINGS = ("enabled", "threshold_ms", "sample_rate", "explain")
+
+    def __init__(self):
+        self.enabled = os.environ.get('SLOW_QUERY_LOG', 'true').lower() == 'true'
+        self.threshold_ms = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100'))
+        self.sample_rate = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', '1.0'))
+        self.explain = os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+        self._commands = {}
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    def start(self, database):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=100)
+        self._worker = asyncio.create_task(self._run(database))
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def settings(self) -> dict:
+        return {key: getattr(self, key) for key in self.SETTINGS}
+
+    def apply(self, settings: dict):
+        for key in self.SETTINGS:
+            if settings.get(key) is not None:
+                setattr(self, key, settings[key])
+
+    async def load(self, database):
+        """Apply the shared runtime settings on top of this worker's environment defaults"""
+        settings = await database.settings.find_one({"_id": self.SETTINGS_ID})
+        if settings:
+            self.apply(settings)
+
+    async def update(self, database, changes: dict) -> dict:
+        settings = await database.settings.find_one_and_update(
+            {"_id": self.SETTINGS_ID},
+            {"$set": changes},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.apply(settings)
+        return settings
+
+    def started(self, event):
+        if not self.enabled or event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        self._commands[(event.connection_id, event.request_id)] = (
+            event.database_name, event.command_name, event.command, current_route()
+        )
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        entry = self._commands.pop((event.connection_id, event.request_id), None)
+        if entry is None or self._queue is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms or random.random() >= self.sample_rate:
+            return
+        self._loop.call_soon_threadsafe(self._enqueue, entry, duration_ms)
+
+    def _enqueue(self, entry, duration_ms):
+        try:
+            self._queue.put_nowait((entry, duration_ms))
+        except asyncio.QueueFull:
+            pass
+
+    async def _run(self, database):
+        while True:
+            (database_name, command_name, command, route), duration_ms = await self._queue.get()
+            record = {
+                "route": route,
+                "collection": _command_collection(command_name, command),
+                "command": command_name,
+                "filter": redact_filter(_command_filter(command_name, command)),
+                "duration_ms": round(duration_ms, 3),
+            }
+            if self.explain:
+                record["explain"] = await self._explain(database.client[database_name], command)
+            slow_query_logger.warning("slow query %s", json.dumps(record, default=str))
+
+    async def _explain(self, database, command):
+        explained = {key: value for key, value in command.items() if not key.startswith("$") and key not in ("lsid", "txnNumber")}
+        try:
+            plan = await database.command({"explain": explained, "verbosity": "queryPlanner"})
+        except Exception as e:
+            return {"error": str(e)}
+        planner = plan.get("queryPlanner")
+        if planner is None:
+            # Aggregations report the plan of their leading $cursor stage
+            planner = plan.get("stages", [{}])[0].get("$cursor", {}).get("queryPlanner", {})
+        # Only the plan's stages and indexes are kept; parsedQuery and index
+        # bounds would carry the literal values the filter shape redacts.
+        return {
+            "winning_plan": _plan_stages(planner.get("winningPlan", {})),
+            "rejected_plans": len(planner.get("rejectedPlans", [])),
+        }
+
+slow_query_log = SlowQueryLog()
+
+# Live events
+LOW_STOCK_THRESHOLD = 10
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get('EVENT_HEARTBEAT_SECONDS', '15'))
+EVENT_BUFFER_SIZE = int(os.environ.get('EVENT_BUFFER_SIZE', '1000'))
+EVENT_CLIENT_QUEUE_SIZE = int(os.environ.get('EVENT_CLIENT_QUEUE_SIZE', '256'))
+
+def encode_event(event_id: int, event_type: str, data) -> str:
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+class EventBroker:
+    """Fan live events out to this worker's stream subscribers.
+
+    Events travel between workers on the invalidation bus and use its sequence
+    number as their id, so an id means the same on every worker and a client
+    can resume on any of them. Each event is encoded once and the same frame is
+    queued for every subscriber of its branch (or of every branch when it has
+    none). Recent frames are kept in the order the bus delivered them, which is
+    the same on every worker, so that reconnecting clients can resume from
+    their Last-Event-ID. A subscriber whose queue fills up is dropped and
+    resumes the same way, so one slow reader never holds up the others.
+    """
+    def __init__(self, buffer_size: int, queue_size: int):
+        self.last_id = 0
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = {}
+        self._queue_size = queue_size
+
+    def dispatch(self, event_id: int, branch_id: Optional[str], event_type: str, data):
+        self.last_id = max(self.last_id, event_id)
+        frame = encode_event(event_id, event_type, data)
+        self._buffer.append((event_id, branch_id, frame))
+        for queue, subscriber_branch in list(self._subscribers.items()):
+            if branch_id is not None and branch_id != subscriber_branch:
+                continue
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def subscribe(self, branch_id: str, last_event_id: Optional[int] = None):
+        """Register a subscriber and return its queue with the frames it missed.
+
+        The missed frames are None when the client's position is no longer
+        buffered and it has to resync.
+        """
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        self._subscribers[queue] = branch_id
+        if last_event_id is None:
+            return queue, None
+        missed = None
+        for event_id, event_branch, frame in self._buffer:
+            if missed is not None and (event_branch is None or event_branch == branch_id):
+                missed.append(frame)
+            elif event_id == last_event_id:
+                missed = []
+        return queue, missed
+
+    def unsubscribe(self, queue):
+        self._subscribers.pop(queue, None)
+
+    def reset(self):
+        # Event order is no longer known to match other workers: make every
+        # client reconnect and resync from a snapshot
+        for queue in list(self._subscribers):
+            self._drop(queue)
+        self._buffer.clear()
+
+    def _drop(self, queue):
+        self._subscribers.pop(queue, None)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+live_events = EventBroker(EVENT_BUFFER_SIZE, EVENT_CLIENT_QUEUE_SIZE)
+
+def stock_change_events(product, old_quantity: int, new_quantity: int) -> list:
+    """Live events for a low-stock transition when a product crosses the threshold"""
+    was_low = old_quantity < LOW_STOCK_THRESHOLD
+    is_low = new_quantity < LOW_STOCK_THRESHOLD
+    if was_low == is_low:
+        return []
+    branch_id = product["branch_id"]
+    return [
+        (branch_id, "stats", {"low_stock_products": 1 if is_low else -1}),
+        (branch_id, "low_stock", {
+            "product_id": product["id"],
+            "product_name": product["name"],
+            "quantity": new_quantity,
+            "low_stock": is_low
+        }),
+    ]
+
+# Cross-worker cache
+CACHE_BUS_COLLECTION = "cache_invalidations"
+CACHE_BUS_SIZE_BYTES = int(os.environ.get('CACHE_BUS_SIZE_BYTES', str(1024 * 1024)))
+CACHE_BUS_RETRY_SECONDS = float(os.environ.get('CACHE_BUS_RETRY_SECONDS', '1'))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+
+cache_logger = logging.getLogger("server.cache")
+
+class VersionedCache:
+    """In-process cache whose entries remember the generation they were loaded in.
+
+    Invalidating a scope or key bumps its generation, so entries loaded before
+    (including loads still in flight) are never served afterwards. The cache is
+    bypassed while the invalidation bus is not connected. At most max_entries
+    are kept, least recently used first out, and per-key generations are
+    bounded the same way, so caching arbitrary keys cannot grow memory.
+    """
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.enabled = False
+        self.max_entries = max_entries
+        self._epoch = 0
+        self._generations = {}
+        self._key_generations = 0
+        self._entries = OrderedDict()
+
+    def _version(self, scope, key):
+        return (self._epoch, self._generations.get(scope, 0), self._generations.get((scope, key), 0))
+
+    async def get(self, scope: str, key: str, loader, miss_ttl: Optional[float] = None):
+        """Cached value for key, loading it on a miss; a None result expires after miss_ttl seconds"""
+        if not self.enabled:
+            return await loader()
+        version = self._version(scope, key)
+        entry = self._entries.get((scope, key))
+        if entry is not None and entry[0] == version and (entry[2] is None or entry[2] > time.monotonic()):
+            self._entries.move_to_end((scope, key))
+            return entry[1]
+        value = await loader()
+        if self.enabled and self._version(scope, key) == version:
+            expires = time.monotonic() + miss_ttl if value is None and miss_ttl is not None else None
+            self._entries[(scope, key)] = (version, value, expires)
+            self._entries.move_to_end((scope, key))
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, scope: str, key: Optional[str] = None):
+        if key is not None and self._key_generations >= self.max_entries:
+            # Forgetting key generations would let in-flight loads match again;
+            # start a new epoch instead, which drops everything at once
+            self._generations = {target: value for target, value in self._generations.items() if not isinstance(target, tuple)}
+            self._key_generations = 0
+            self.clear()
+        target = scope if key is None else (scope, key)
+        if key is not None and target not in self._generations:
+            self._key_generations += 1
+        self._generations[target] = self._generations.get(target, 0) + 1
+
+    def clear(self):
+        self._epoch += 1
+        self._entries.clear()
+
+class InvalidationBus:
+    """Broadcast cache invalidations and live events to every worker through a capped collection.
+
+    Each message carries a sequence number from a shared counter. Workers tail
+    the collection and flush their whole cache when they see a gap, so a
+    missed message costs a re-fetch rather than stale data. A tailable cursor
+    on a capped collection works on a standalone mongod, unlike change streams.
+    """
+    def __init__(self, cache: VersionedCache, events: EventBroker):
+        self.cache = cache
+        self.events = events
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_seq = 0
+        self._db = None
+        self._task = None
+        self._listeners = {}
+
+    def listen(self, scope: str, callback):
+        """Await ``callback(key)`` whenever another worker's invalidation of scope arrives"""
+        self._listeners.setdefault(scope, []).append(callback)
+
+    async def start(self, database):
+        self._db = database
+        try:
+            await database.create_collection(CACHE_BUS_COLLECTION, capped=True, size=CACHE_BUS_SIZE_BYTES)
+        except CollectionInvalid:
+            pass
+        except Exception as e:
+            cache_logger.warning("Cache invalidation bus unavailable, caching disabled: %s", e)
+            return
+        counter = await database.counters.find_one({"_id": CACHE_BUS_COLLECTION})
+        self.last_seq = counter["seq"] if counter else 0
+        self.events.last_id = self.last_seq
+        self._task = asyncio.create_task(self._tail())
+
+    def stop(self):
+        self.cache.enabled = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, scope: str, key: Optional[str] = None):
+        await self.publish_batch(invalidations=[(scope, key)])
+
+    async def publish_batch(self, invalidations=(), events=()):
+        """Send (scope, key) invalidations and (branch_id, type, data) live events in one write"""
+        # Apply locally first so this worker reads its own writes
+        for scope, key in invalidations:
+            self.cache.invalidate(scope, key)
+        if self._task is None:
+            # No bus: only this worker's own streams can be reached
+            for branch_id, event_type, data in events:
+                self.events.dispatch(self.events.last_id + 1, branch_id, event_type, data)
+            return
+        messages = [{"scope": scope, "key": key} for scope, key in invalidations]
+        messages += [{"event": event_type, "branch_id": branch_id, "data": data} for branch_id, event_type, data in events]
+        if not messages:
+            return
+        counter = await self._db.counters.find_one_and_update(
+            {"_id": CACHE_BUS_COLLECTION},
+            {"$inc": {"seq": len(messages)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        first_seq = counter["seq"] - len(messages) + 1
+        created_at = datetime.now(timezone.utc).isoformat()
+        await self._db[CACHE_BUS_COLLECTION].insert_many([
+            {**message, "seq": first_seq + i, "origin": self.origin, "created_at": created_at}
+            for i, message in enumerate(messages)
+        ])
+
+    def _apply(self, message):
+        if message["seq"] > self.last_seq + 1:
+            # Messages were missed (or arrived out of order): start over
+            self.cache.clear()
+        self.last_seq = max(self.last_seq, message["seq"])
+        if "event" in message:
+            self.events.dispatch(message["seq"], message.get("branch_id"), message["event"], message["data"])
+        else:
+            self.cache.invalidate(message["scope"], message.get("key"))
+
+    async def _notify(self, scope: str, key: Optional[str]):
+        for callback in self._listeners.get(scope, ()):
+            try:
+                await callback(key)
+            except Exception as e:
+                cache_logger.warning("Invalidation listener for %s failed: %s", scope, e)
+
+    async def _tail(self):
+        collection = self._db[CACHE_BUS_COLLECTION]
+        while True:
+            try:
+                cursor = collection.find({"seq": {"$gt": self.last_seq}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                # Anything missed while disconnected is caught by the seq check
+                self.cache.enabled = True
+                # Listeners cannot tell what they missed: refresh them all
+                for scope in self._listeners:
+                    await self._notify(scope, None)
+                while cursor.alive:
+                    async for message in cursor:
+                        self._apply(message)
+                        if "scope" in message:
+                            await self._notify(message["scope"], message.get("key"))
+                    await asyncio.sleep(CACHE_BUS_RETRY_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                cache_logger.warning("Cache invalidation bus disconnected: %s", e)
+                self.cache.enabled = False
+                self.cache.clear()
+                self.events.reset()
+            await asyncio.sleep(CACHE_BUS_RETRY_SECONDS)
+
+shared_cache = VersionedCache()
+invalidation_bus = InvalidationBus(shared_cache, live_events)
+
+async def reload_slow_query_log(key):
+    await slow_query_log.load(db)
+
+invalidation_bus.listen("settings", reload_slow_query_log)
+
+# Login throttling
+LOGIN_USER_RATE_PER_MINUTE = float(os.environ.get('LOGIN_USER_RATE_PER_MINUTE', '5'))
+LOGIN_USER_BURST = int(os.environ.get('LOGIN_USER_BURST', '5'))
+LOGIN_IP_RATE_PER_MINUTE = float(os.environ.get('LOGIN_IP_RATE_PER_MINUTE', '30'))
+LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST', '30'))
+LOGIN_THROTTLE_MAX_KEYS = int(os.environ.get('LOGIN_THROTTLE_MAX_KEYS', '100000'))
+# Unknown usernames are remembered this long, so guesses stay cheap without
+# filling the cache for good
+USER_MISS_CACHE_SECONDS = float(os.environ.get('USER_MISS_CACHE_SECONDS', '60'))
+# Addresses (or CIDR ranges) of the ingress and other proxies in front of the
+# API. Requests through them are throttled on the client address from
+# X-Forwarded-For; without this every client behind the ingress would share
+# its address and one IP bucket. Forwarded headers from anyone else are ignored.
+TRUSTED_PROXIES = [ipaddress.ip_network(proxy.strip()) for proxy in os.environ.get('TRUSTED_PROXIES', '').split(',') if proxy.strip()]
+
+class TokenBucketLimiter:
+    """Per-key token buckets, refilled continuously at rate_per_minute up to burst.
+
+    Buckets live in this worker only, so the effective limit scales with the
+    number of workers. Least recently used keys are dropped beyond max_keys;
+    a dropped key comes back with a full bucket.
+    """
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Take a token for key; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_address(request: Request) -> str:
+    """The client's address, looking through trusted proxies"""
+    address = request.client.host if request.client else ""
+    if not is_trusted_proxy(address):
+        return address
+    # Proxies append the address they received from, so the nearest
+    # untrusted hop from the right is the client
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(forwarded):
+        address = hop
+        if not is_trusted_proxy(hop):
+            break
+    return address
+
+login_user_limiter = TokenBucketLimiter(LOGIN_USER_RATE_PER_MINUTE, LOGIN_USER_BURST, LOGIN_THROTTLE_MAX_KEYS)
+login_ip_limiter = TokenBucketLimiter(LOGIN_IP_RATE_PER_MINUTE, LOGIN_IP_BURST, LOGIN_THROTTLE_MAX_KEYS)
+
+def throttle_login(request: Request, username: str):
+    """Reject with 429 once the client address or the username runs out of attempts"""
+    for reason, limiter, key in (
+        ("throttled_ip", login_ip_limiter, client_address(request)),
+        ("throttled_user", login_user_limiter, username),
+    ):
+        retry_after = limiter.acquire(key)
+        if retry_after:
+            LOGIN_ATTEMPTS_REJECTED.labels(reason).inc()
+            raise HTTPException(
+                status_code=429,
+                detail="Too many login attempts, try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+# Background jobs
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', '2'))
+JOB_PROCESS_WORKERS = int(os.environ.get('JOB_PROCESS_WORKERS', '2'))
+JOB_RESULTS_DIR = Path(os.environ.get('JOB_RESULTS_DIR', str(ROOT_DIR / 'job_results')))
+# Workers heartbeat their queued and running jobs; a job whose heartbeat is
+# older than JOB_STALE_SECONDS lost its worker and is marked failed
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', '15'))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', '60'))
+
+class JobCancelled(Exception):
+    pass
+
+class JobContext:
+    """Handed to job handlers for progress reporting and running CPU-heavy steps"""
+    def __init__(self, runner, job_id: str):
+        self.runner = runner
+        self.job_id = job_id
+
+    async def progress(self, fraction: float, message: str = ""):
+        # One round trip both records progress and picks up cancel requests
+        # made through any worker
+        job = await db.jobs.find_one_and_update(
+            {"id": self.job_id},
+            {"$set": {"progress": round(min(max(fraction, 0.0), 1.0), 4), "message": message}},
+            projection={"cancel_requested": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if job and job.get("cancel_requested"):
+            raise JobCancelled()
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.runner.process_pool, partial(fn, *args, **kwargs))
+
+    def result_path(self, suffix: str) -> Path:
+        return JOB_RESULTS_DIR / f"{self.job_id}{suffix}"
+
+class JobRunner:
+    """Run long operations outside request handlers.
+
+    Job state lives in the jobs collection so any worker can report on it.
+    I/O steps run as asyncio tasks on this worker, limited to JOB_CONCURRENCY
+    at a time; CPU-heavy steps go to a process pool so they never stall the
+    event loop. Jobs left behind by a worker that stopped (a restart or a
+    crash) stop getting heartbeats and are failed by whichever worker notices.
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.process_pool = None
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = {}
+        self._slots = None
+        self._heartbeat = None
+
+    def register(self, job_type: str):
+        def decorator(handler):
+            self.handlers[job_type] = handler
+            return handler
+        return decorator
+
+    def start(self):
+        JOB_RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        self._slots = asyncio.Semaphore(JOB_CONCURRENCY)
+        # spawn, not fork: forking a process that runs driver threads can deadlock
+        self.process_pool = ProcessPoolExecutor(JOB_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = None
+
+    def submit(self, job_id: str, job_type: str, params: dict):
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id, job_type, params))
+
+    async def cancel(self, job_id: str):
+        await db.jobs.update_one({"id": job_id}, {"$set": {"cancel_requested": True}})
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        else:
+            # No live worker will pick the flag up if the job was orphaned
+            await db.jobs.update_one(
+                {"id": job_id, **self._stale_filter()},
+                {"$set": {"status": "cancelled", "finished_at": datetime.now(timezone.utc).isoformat()}}
+            )
+
+    def _stale_filter(self) -> dict:
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=JOB_STALE_SECONDS)).isoformat()
+        return {
+            "status": {"$in": ["queued", "running"]},
+            "$or": [{"heartbeat_at": {"$lt": cutoff}}, {"heartbeat_at": None}]
+        }
+
+    async def _beat(self):
+        while True:
+            try:
+                now = datetime.now(timezone.utc).isoformat()
+                if self._tasks:
+                    await db.jobs.update_many({"id": {"$in": list(self._tasks)}}, {"$set": {"heartbeat_at": now}})
+                orphaned = await db.jobs.update_many(self._stale_filter(), {"$set": {
+                    "status": "failed",
+                    "error": "The worker running this job stopped before it finished",
+                    "finished_at": now
+                }})
+                if orphaned.modified_count:
+                    logger.warning("Marked %d orphaned jobs as failed", orphaned.modified_count)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job heartbeat failed")
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+
+    async def _finish(self, job_id: str, status: str, **fields):
+        await db.jobs.update_one({"id": job_id}, {"$set": {
+            "status": status,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            **fields
+        }})
+
+    async def _run(self, job_id: str, job_type: str, params: dict):
+        context = JobContext(self, job_id)
+        try:
+            async with self._slots:
+                job = await db.jobs.find_one_and_update(
+                    {"id": job_id, "cancel_requested": {"$ne": True}},
+                    {"$set": {"status": "running", "started_at": datetime.now(timezone.utc).isoformat()}}
+                )
+                if job is None:
+                    raise JobCancelled()
+                result_file = await self.handlers[job_type](context, params)
+            await self._finish(job_id, "succeeded", progress=1.0, result_file=str(result_file) if result_file else None)
+        except (JobCancelled, asyncio.CancelledError):
+            await self._finish(job_id, "cancelled")
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, job_type)
+            await self._finish(job_id, "failed", error=str(e))
+        finally:
+            self._tasks.pop(job_id, None)
+
+job_runner = JobRunner()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+CART_HOLD_TTL_SECONDS = int(os.environ.get('CART_HOLD_TTL_SECONDS', '900'))
+STOCK_SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('STOCK_SNAPSHOT_INTERVAL_SECONDS', '3600'))
+# Snapshots stop this far in the past so in-flight movements have landed
+STOCK_SNAPSHOT_LAG_SECONDS = float(os.environ.get('STOCK_SNAPSHOT_LAG_SECONDS', '60'))
+FORECAST_INTERVAL_SECONDS = float(os.environ.get('FORECAST_INTERVAL_SECONDS', '3600'))
+FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', '90'))
+FORECAST_LEAD_TIME_DAYS = float(os.environ.get('FORECAST_LEAD_TIME_DAYS', '7'))
+FORECAST_REVIEW_DAYS = float(os.environ.get('FORECAST_REVIEW_DAYS', '7'))
+FORECAST_SERVICE_Z = float(os.environ.get('FORECAST_SERVICE_Z', '1.65'))
+# Bills older than this move to monthly archive partitions; 0 disables the
+# periodic run. Never less than the forecast window, which reads hot bills only.
+BILL_ARCHIVE_AFTER_DAYS = int(os.environ.get('BILL_ARCHIVE_AFTER_DAYS', '365'))
+BILL_ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('BILL_ARCHIVE_INTERVAL_SECONDS', '86400'))
+BILL_ARCHIVE_BATCH_SIZE = int(os.environ.get('BILL_ARCHIVE_BATCH_SIZE', '1000'))
+BILL_ARCHIVE_COMPRESSOR = os.environ.get('BILL_ARCHIVE_COMPRESSOR', 'zstd')
+# Bills never change, so a rendered receipt stays valid until the template does
+RECEIPT_CACHE_TTL_SECONDS = int(os.environ.get('RECEIPT_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+RECEIPT_BATCH_SIZE = int(os.environ.get('RECEIPT_BATCH_SIZE', '50'))
+
+# Created by the lifespan handler
+client = None
+db = None
+
+def create_mongo_client():
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [MongoCommandMetrics(), MongoPoolMetrics(), slow_query_log],
+        # Hold expiry and ledger times are stored as BSON dates
+        "tz_aware": True,
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return AsyncIOMotorClient(mongo_url, **options)
+
+async def ensure_indexes():
+    # Expired holds are removed by the TTL monitor, which runs about once a
+    # minute, so queries still filter on expires_at
+    await db.holds.create_index("expires_at", expireAfterSeconds=0)
+    await db.holds.create_index([("product_id", 1), ("expires_at", 1)])
+    # One hold per cart and product, so concurrent updates upsert the same hold
+    await db.holds.create_index([("branch_id", 1), ("cart_id", 1), ("product_id", 1)], unique=True)
+    await db.holds.create_index([("branch_id", 1), ("expires_at", 1)])
+    # Every branch-scoped listing, count and range query leads with branch_id
+    await db.users.create_index("username")
+    await db.products.create_index([("branch_id", 1), ("id", 1)])
+    await db.products.create_index([("branch_id", 1), ("quantity", 1)])
+    await db.stock_movements.create_index([("product_id", 1), ("created_at", 1)])
+    # A product's ledger within its branch; also finds unbranched movements
+    await db.stock_movements.create_index([("branch_id", 1), ("product_id", 1), ("created_at", 1)])
+    await db.stock_movements.create_index("created_at")
+    # Opening balances use a movement id keyed by product, so each is written once
+    await db.stock_movements.create_index("id", unique=True)
+    await db.stock_movements.create_index([("reason", 1), ("product_id", 1)])
+    await db.stock_snapshots.create_index([("product_id", 1), ("as_of", -1)])
+    await db.stock_snapshot_runs.create_index([("as_of", -1)])
+    await db.bills.create_index([("branch_id", 1), ("date", 1)])
+    # The forecast and the archiver read every branch's bills by date
+    await db.bills.create_index("date")
+    await db.bills.create_index([("branch_id", 1), ("id", 1)])
+    await db.bills.create_index([("branch_id", 1), ("bill_number", 1)])
+    # Contact prefix search pages in (contact, newest first) order off this index
+    await db.bills.create_index([("branch_id", 1), ("customer_contact", 1), ("date", -1)])
+    # Word search within a branch; requires an equality match on branch_id
+    await db.bills.create_index([
+        ("branch_id", 1),
+        ("bill_number", "text"),
+        ("customer_contact", "text"),
+        ("customer_name", "text"),
+        ("items.product_name", "text")
+    ], name="bill_search", weights={"bill_number": 10, "customer_contact": 10, "customer_name": 5, "items.product_name": 1})
+    await db.bill_archive.create_index("id", unique=True)
+    await db.bill_archive.create_index([("branch_id", 1), ("date", 1)])
+    await db.bill_archive.create_index([("branch_id", 1), ("bill_number", 1)])
+    await db.reorder_suggestions.create_index([("branch_id", 1), ("run_id", 1), ("needs_reorder", 1), ("days_of_cover", 1)])
+    await db.reorder_suggestions.create_index("run_id")
+    await db.forecast_runs.create_index([("generated_at", -1), ("_id", -1)])
+    await db.receipts.create_index("created_at", expireAfterSeconds=RECEIPT_CACHE_TTL_SECONDS)
+    await db.jobs.create_index("id", unique=True)
+    await db.jobs.create_index([("branch_id", 1), ("created_at", -1)])
+
+BRANCH_SCOPED_COLLECTIONS = ["users", "products", "bills", "bill_archive", "holds", "stock_movements", "jobs"]
+
+BRANCH_FIELDS_MIGRATION = "branch_fields"
+
+async def ensure_branch_fields():
+    # Documents written before branches existed belong to the default branch.
+    # Everything written since carries a branch, so once a pass has covered
+    # every collection later startups skip the scan.
+    if await db.migrations.find_one({"_id": BRANCH_FIELDS_MIGRATION}):
+        return
+    for name in BRANCH_SCOPED_COLLECTIONS:
+        await db[name].update_many({"branch_id": {"$exists": False}}, {"$set": {"branch_id": DEFAULT_BRANCH}})
+    await db.migrations.update_one(
+        {"_id": BRANCH_FIELDS_MIGRATION},
+        {"$set": {"completed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+async def warm_up_mongo():
+    # Concurrent pings make the pool open (and TLS-handshake) up to
+    # MONGO_MIN_POOL_SIZE connections before the first request arrives;
+    # minPoolSize then keeps them open.
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(max(1, MONGO_MIN_POOL_SIZE))))
+
+# Branches
+# Tokens issued before branches existed carry no branch claim
+DEFAULT_BRANCH = os.environ.get('DEFAULT_BRANCH', 'main')
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-this')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db
+    client = create_mongo_client()
+    db = client[os.environ['DB_NAME']]
+    await warm_up_mongo()
+    await ensure_indexes()
+    await ensure_branch_fields()
+    await ensure_bill_sequence()
+    loop_monitor = asyncio.create_task(monitor_event_loop_lag())
+    slow_query_log.start(db)
+    await slow_query_log.load(db)
+    await invalidation_bus.start(db)
+    stock_snapshotter = asyncio.create_task(run_stock_snapshots_periodically())
+    demand_forecaster = asyncio.create_task(run_demand_forecast_periodically())
+    bill_archiver = asyncio.create_task(run_bill_archive_periodically())
+    job_runner.start()
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    await job_runner.stop()
+    loop_monitor.cancel()
+    stock_snapshotter.cancel()
+    demand_forecaster.cancel()
+    bill_archiver.cancel()
+    slow_query_log.stop()
+    invalidation_bus.stop()
+    client.close()
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Drop this worker's live gauges from the aggregate
+        multiprocess.mark_process_dead(os.getpid())
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Security
 security = HTTPBearer()
+# EventSource cannot send headers, so streams also accept ?token=
+optional_security = HTTPBearer(auto_error=False)
 
 # Pydantic Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     username: str
     password: str
+    branch_id: str = DEFAULT_BRANCH
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserLogin(BaseModel):
     username: str
     password: str
 
+class PasswordChange(BaseModel):
+    current_password: str
+    new_password: str
+
 class UserResponse(BaseModel):
     id: str
     username: str
+    branch_id: str = DEFAULT_BRANCH
     created_at: datetime
 
 class Category(BaseModel):
@@ -72,8 +1059,13 @@ class Product(BaseModel):
     quantity: int
     image_url: Optional[str] = ""
     description: Optional[str] = ""
+    branch_id: str = DEFAULT_BRANCH
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ProductListing(Product):
+    # On-hand quantity minus stock held by active carts
+    available_quantity: int
+
 class ProductCreate(BaseModel):
     name: str
     category_id: str
@@ -120,11 +1112,111 @@ class Bill(BaseModel):
     date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     items: List[BillItem]
     total: float
+    branch_id: str = DEFAULT_BRANCH
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class BillSearchHit(Bill):
+    score: float
+
+class BillSearchPage(BaseModel):
+    page: int
+    page_size: int
+    has_more: bool
+    results: List[BillSearchHit]
+
+class BillItemCreate(BaseModel):
+    product_id: str
+    quantity: int = Field(ge=1)
+
 class BillCreate(BaseModel):
     customer_id: str
-    items: List[Dict[str, Any]]  # {product_id, quantity}
+    items: List[BillItemCreate] = []
+    cart_id: Optional[str] = None  # bill the cart's held items instead
+
+class StockHold(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    cart_id: str
+    product_id: str
+    product_name: str
+    quantity: int
+    expires_at: datetime
+    branch_id: str = DEFAULT_BRANCH
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class Cart(BaseModel):
+    cart_id: str
+    items: List[StockHold]
+    expires_at: Optional[datetime] = None
+
+class CartItemUpdate(BaseModel):
+    quantity: int = Field(ge=0)
+
+class StockMovement(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    product_id: str
+    delta: int
+    reason: str  # opening, initial, sale, adjustment, removed
+    reference: Optional[str] = None
+    branch_id: str = DEFAULT_BRANCH
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class StockLevel(BaseModel):
+    product_id: str
+    quantity: int
+    at: datetime
+    snapshot_as_of: Optional[datetime] = None
+    movements_applied: int
+
+class ReorderSuggestion(BaseModel):
+    product_id: str
+    product_name: str
+    quantity: int
+    velocity: float
+    demand_ma_7: float
+    demand_ma_28: float
+    forecast_daily_demand: float
+    days_of_cover: Optional[float] = None  # None when there is no demand
+    reorder_point: int
+    suggested_order_quantity: int
+    needs_reorder: bool
+
+class ReorderReport(BaseModel):
+    generated_at: Optional[datetime] = None
+    suggestions: List[ReorderSuggestion]
+
+class JobCreate(BaseModel):
+    type: str
+    params: Dict[str, Any] = {}
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    type: str
+    params: Dict[str, Any] = {}
+    status: str = "queued"  # queued, running, succeeded, failed, cancelled
+    progress: float = 0.0
+    message: Optional[str] = ""
+    error: Optional[str] = None
+    result_file: Optional[str] = None
+    cancel_requested: bool = False
+    created_by: str
+    branch_id: str = DEFAULT_BRANCH
+    worker: Optional[str] = None
+    heartbeat_at: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class SlowQueryLogSettings(BaseModel):
+    enabled: bool
+    threshold_ms: float
+    sample_rate: float
+    explain: bool
+
+class SlowQueryLogUpdate(BaseModel):
+    enabled: Optional[bool] = None
+    threshold_ms: Optional[float] = Field(default=None, ge=0)
+    sample_rate: Optional[float] = Field(default=None, ge=0, le=1)
+    explain: Optional[bool] = None
 
 class DashboardStats(BaseModel):
     total_products: int
@@ -151,15 +1243,460 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def decode_access_claims(token: str) -> dict:
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        return username
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return payload
+
+def decode_access_token(token: str) -> str:
+    return decode_access_claims(token)["sub"]
+
+async def find_user(username: str):
+    """User document by username, served from the shared cache.
+
+    Unknown usernames are cached too, for USER_MISS_CACHE_SECONDS, so repeated
+    guesses cost no query; register and password changes publish an
+    invalidation for the username.
+    """
+    async def load():
+        return await db.users.find_one({"username": username}, {"_id": 0})
+    return await shared_cache.get("users", username, load, miss_ttl=USER_MISS_CACHE_SECONDS)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return decode_access_token(credentials.credentials)
+
+async def get_current_branch(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Branch the caller works in, from the token's branch claim"""
+    return decode_access_claims(credentials.credentials).get("branch", DEFAULT_BRANCH)
+
+async def get_registering_branch(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Branch for a new user: the registering user's own, or the default branch when anonymous"""
+    if credentials is None:
+        return DEFAULT_BRANCH
+    return decode_access_claims(credentials.credentials).get("branch", DEFAULT_BRANCH)
+
+def stream_token(token: Optional[str], credentials: Optional[HTTPAuthorizationCredentials]) -> str:
+    if credentials is not None:
+        return credentials.credentials
+    if token is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return token
+
+async def get_stream_branch(token: Optional[str] = None, credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    return decode_access_claims(stream_token(token, credentials)).get("branch", DEFAULT_BRANCH)
+
+async def active_holds(query: dict) -> list:
+    query = {**query, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    return await db.holds.find(query).to_list(length=None)
+
+async def held_quantities(product_ids: Optional[List[str]] = None, branch_id: Optional[str] = None) -> Dict[str, int]:
+    """Quantities held by active carts, per product"""
+    match = {"expires_at": {"$gt": datetime.now(timezone.utc)}}
+    if product_ids is not None:
+        match["product_id"] = {"$in": product_ids}
+    if branch_id is not None:
+        match["branch_id"] = branch_id
+    held = await db.holds.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}}
+    ]).to_list(length=None)
+    return {entry["_id"]: entry["quantity"] for entry in held}
+
+async def restore_holds(holds: list):
+    """Put back holds claimed by a checkout that did not go through"""
+    if holds:
+        try:
+            await db.holds.insert_many(holds, ordered=False)
+        except BulkWriteError:
+            # The cart already holds the product again
+            pass
+
+def opening_movement_id(product_id: str) -> str:
+    return f"opening:{product_id}"
+
+async def record_stock_movements(movements: List[StockMovement]):
+    # Not prepare_for_mongo: created_at stays a date for range queries
+    if movements:
+        await db.stock_movements.insert_many([movement.dict() for movement in movements], ordered=False)
+
+async def latest_stock_snapshots(product_ids: List[str], as_of: datetime) -> Dict[str, int]:
+    snapshots = await db.stock_snapshots.aggregate([
+        {"$match": {"product_id": {"$in": product_ids}, "as_of": {"$lte": as_of}}},
+        {"$sort": {"product_id": 1, "as_of": -1}},
+        {"$group": {"_id": "$product_id", "quantity": {"$first": "$quantity"}}}
+    ]).to_list(length=None)
+    return {snapshot["_id"]: snapshot["quantity"] for snapshot in snapshots}
+
+# Leases: every worker runs the periodic maintenance loops, but each run
+# only goes ahead on the worker holding that job's lease. The holder renews it
+# on every run and a lease lasts two intervals, so it stays with a live holder;
+# if the holder stops, another worker takes over once the lease expires.
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+async def acquire_lease(name: str, seconds: float) -> bool:
+    """Take or renew the named lease for this worker; False while another worker holds it"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": LEASE_OWNER}]},
+            {"$set": {"owner": LEASE_OWNER, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The lease exists and did not match: another worker holds it
+        return False
+    return True
+
+stock_snapshot_lock = asyncio.Lock()
+
+async def backfill_opening_stock(as_of: datetime, last_run: Optional[dict]):
+    """Give every product without an opening or initial movement an opening balance.
+
+    Products can reach the collection without going through the API (seed
+    data, imports, the load test) or predate the ledger and have sold since.
+    The opening makes the ledger sum to the current quantity and is dated just
+    before the product's first movement; snapshots already taken past that
+    point are corrected to include it.
+    """
+    opened = set(await db.stock_movements.distinct("product_id", {"reason": {"$in": ["opening", "initial"]}}))
+    products = [
+        product for product in await db.products.find({}, {"id": 1, "quantity": 1, "branch_id": 1}).to_list(length=None)
+        if product["id"] not in opened
+    ]
+    if not products:
+        return 0
+    ledger = {row["_id"]: row for row in await db.stock_movements.aggregate([
+        {"$match": {"product_id": {"$in": [product["id"] for product in products]}}},
+        {"$group": {"_id": "$product_id", "delta": {"$sum": "$delta"}, "first": {"$min": "$created_at"}}}
+    ]).to_list(length=None)}
+    openings = []
+    for product in products:
+        moved = ledger.get(product["id"])
+        created_at = as_of
+        if moved:
+            created_at = min(as_of, moved["first"] - timedelta(milliseconds=1))
+        openings.append(StockMovement(
+            id=opening_movement_id(product["id"]),
+            product_id=product["id"],
+            delta=product["quantity"] - (moved["delta"] if moved else 0),
+            reason="opening",
+            branch_id=product.get("branch_id", DEFAULT_BRANCH),
+            created_at=created_at
+        ))
+    
+    failed = set()
+    try:
+        await record_stock_movements(openings)
+    except BulkWriteError as e:
+        # Another run or create_product wrote these openings first
+        failed = {error["index"] for error in e.details["writeErrors"]}
+    written = [opening for index, opening in enumerate(openings) if index not in failed]
+    
+    if last_run:
+        for opening in written:
+            if opening.created_at > last_run["as_of"]:
+                continue  # This run's window picks it up
+            corrected = await db.stock_snapshots.update_many(
+                {"product_id": opening.product_id, "as_of": {"$gte": opening.created_at}},
+                {"$inc": {"quantity": opening.delta}}
+            )
+            if not corrected.matched_count:
+                # No movements up to the last run, so the opening is all there is
+                await db.stock_snapshots.insert_one({"product_id": opening.product_id, "quantity": opening.delta, "as_of": last_run["as_of"]})
+    return len(written)
+
+async def take_stock_snapshot():
+    """Roll the movements since the previous run into per-product snapshots.
+
+    Only products that moved since the previous run get a new snapshot, so a
+    run costs a scan of the ledger tail rather than of every bill or product.
+    Runs are serialized by the "stock_snapshot" lease and, within a worker,
+    by stock_snapshot_lock.
+    """
+    async with stock_snapshot_lock:
+        as_of = datetime.now(timezone.utc) - timedelta(seconds=STOCK_SNAPSHOT_LAG_SECONDS)
+        # BSON dates have millisecond precision; keep windows aligned with them
+        as_of = as_of.replace(microsecond=as_of.microsecond // 1000 * 1000)
+        last_run = await db.stock_snapshot_runs.find_one(sort=[("as_of", -1)])
+        window = {"$lte": as_of}
+        if last_run:
+            window["$gt"] = last_run["as_of"]
+        await backfill_opening_stock(as_of, last_run)
+        
+        totals = await db.stock_movements.aggregate([
+            {"$match": {"created_at": window}},
+            {"$group": {"_id": "$product_id", "delta": {"$sum": "$delta"}}}
+        ]).to_list(length=None)
+        if totals:
+            previous = {}
+            if last_run:
+                previous = await latest_stock_snapshots([total["_id"] for total in totals], last_run["as_of"])
+            await db.stock_snapshots.insert_many([
+                {"product_id": total["_id"], "quantity": previous.get(total["_id"], 0) + total["delta"], "as_of": as_of}
+                for total in totals
+            ], ordered=False)
+        await db.stock_snapshot_runs.insert_one({"as_of": as_of, "products": len(totals)})
+        return as_of, len(totals)
+
+async def take_stock_snapshot_now():
+    """Run a snapshot on demand under the periodic loop's lease; None while another worker holds it"""
+    if not await acquire_lease("stock_snapshot", STOCK_SNAPSHOT_INTERVAL_SECONDS * 2):
+        return None
+    return await take_stock_snapshot()
+
+async def run_stock_snapshots_periodically():
+    while True:
+        try:
+            if await acquire_lease("stock_snapshot", STOCK_SNAPSHOT_INTERVAL_SECONDS * 2):
+                await take_stock_snapshot()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Stock snapshot failed")
+        await asyncio.sleep(STOCK_SNAPSHOT_INTERVAL_SECONDS)
+
+async def stock_level_at(product_id: str, at: datetime) -> StockLevel:
+    snapshot = await db.stock_snapshots.find_one(
+        {"product_id": product_id, "as_of": {"$lte": at}},
+        sort=[("as_of", -1)]
+    )
+    window = {"$lte": at}
+    if snapshot:
+        window["$gt"] = snapshot["as_of"]
+    tail = await db.stock_movements.aggregate([
+        {"$match": {"product_id": product_id, "created_at": window}},
+        {"$group": {"_id": None, "delta": {"$sum": "$delta"}, "count": {"$sum": 1}}}
+    ]).to_list(length=None)
+    return StockLevel(
+        product_id=product_id,
+        quantity=(snapshot["quantity"] if snapshot else 0) + (tail[0]["delta"] if tail else 0),
+        at=at,
+        snapshot_as_of=snapshot["as_of"] if snapshot else None,
+        movements_applied=tail[0]["count"] if tail else 0
+    )
+
+async def latest_forecast_run() -> Optional[dict]:
+    return await db.forecast_runs.find_one(sort=[("generated_at", -1), ("_id", -1)])
+
+async def run_demand_forecast():
+    """Recompute reorder suggestions for the whole catalogue.
+
+    Mongo pre-aggregates bill items to one row per product and day; the
+    forecast itself runs vectorized in a worker thread.
+    """
+    # Runs can share a timestamp, so each batch is told apart by its run id
+    run_id = str(uuid.uuid4())
+    generated_at = datetime.now(timezone.utc)
+    generated_at = generated_at.replace(microsecond=generated_at.microsecond // 1000 * 1000)
+    today = generated_at.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - timedelta(days=FORECAST_HISTORY_DAYS)
+    sales = await db.bills.aggregate([
+        {"$match": {"date": {"$gte": start.isoformat(), "$lt": today.isoformat()}}},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"product_id": "$items.product_id", "day": {"$substrBytes": ["$date", 0, 10]}},
+            "quantity": {"$sum": "$items.quantity"}
+        }}
+    ], allowDiskUse=True).to_list(length=None)
+    products = await db.products.find({}, {"_id": 0, "id": 1, "name": 1, "quantity": 1, "branch_id": 1}).to_list(length=None)
+    
+    sales_frame = pd.DataFrame(
+        [(row["_id"]["product_id"], row["_id"]["day"], row["quantity"]) for row in sales],
+        columns=["product_id", "day", "quantity"]
+    )
+    products_frame = pd.DataFrame(products, columns=["id", "name", "quantity", "branch_id"])
+    suggestions = await asyncio.get_running_loop().run_in_executor(None, partial(
+        compute_reorder_suggestions,
+        products_frame,
+        sales_frame,
+        generated_at,
+        history_days=FORECAST_HISTORY_DAYS,
+        lead_time_days=FORECAST_LEAD_TIME_DAYS,
+        review_days=FORECAST_REVIEW_DAYS,
+        service_z=FORECAST_SERVICE_Z
+    ))
+    # Product ids are unique across branches, so one pass covers every branch
+    suggestions["branch_id"] = products_frame["branch_id"].to_numpy()
+    
+    # to_json turns numpy scalars into plain values and infinite cover into null
+    docs = json.loads(suggestions.to_json(orient="records"))
+    for doc in docs:
+        doc["run_id"] = run_id
+        doc["generated_at"] = generated_at
+    if docs:
+        await db.reorder_suggestions.insert_many(docs, ordered=False)
+    # Readers switch to the new batch at once; every other batch is then
+    # dropped. Concurrent runs all keep the same latest run.
+    await db.forecast_runs.insert_one({"run_id": run_id, "generated_at": generated_at, "products": len(docs)})
+    current = await latest_forecast_run()
+    await db.reorder_suggestions.delete_many({"run_id": {"$ne": current["run_id"]}})
+    return generated_at, len(docs)
+
+async def run_demand_forecast_periodically():
+    while True:
+        try:
+            if await acquire_lease("demand_forecast", FORECAST_INTERVAL_SECONDS * 2):
+                await run_demand_forecast()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Demand forecast failed")
+        await asyncio.sleep(FORECAST_INTERVAL_SECONDS)
+
+# Bill archive: bills older than BILL_ARCHIVE_AFTER_DAYS move, a whole
+# month at a time, into bills_archive_YYYY_MM collections created with block
+# compression. bill_archive is the small lookup index of id -> partition.
+BILL_SEQUENCE = "bill_number"
+
+def bill_sequence(branch_id: str) -> str:
+    # The default branch keeps the sequence (and numbering) it had before branches
+    return BILL_SEQUENCE if branch_id == DEFAULT_BRANCH else f"{BILL_SEQUENCE}:{branch_id}"
+
+async def ensure_bill_sequence():
+    # Bill numbers come from a counter per branch rather than counting bills,
+    # which would reuse numbers once bills are archived. Only branches without
+    # a counter yet are counted, so startup stays cheap once they exist.
+    branches = set(await db.bills.distinct("branch_id")) | set(await db.bill_archive.distinct("branch_id"))
+    sequences = {bill_sequence(branch_id): branch_id for branch_id in branches}
+    existing = await db.counters.find({"_id": {"$in": list(sequences)}}, {"_id": 1}).to_list(length=None)
+    for sequence in set(sequences) - {counter["_id"] for counter in existing}:
+        branch_id = sequences[sequence]
+        issued = await db.bills.count_documents({"branch_id": branch_id}) + await db.bill_archive.count_documents({"branch_id": branch_id})
+        await db.counters.update_one({"_id": sequence}, {"$max": {"seq": issued}}, upsert=True)
+
+async def next_bill_number(branch_id: str) -> str:
+    counter = await db.counters.find_one_and_update(
+        {"_id": bill_sequence(branch_id)},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return format_bill_number(branch_id, counter["seq"])
+
+def format_bill_number(branch_id: str, seq: int) -> str:
+    if branch_id == DEFAULT_BRANCH:
+        return f"INF-{seq:05d}"
+    return f"INF-{branch_id.upper()}-{seq:05d}"
+
+def bill_archive_partition(date: str) -> str:
+    return f"bills_archive_{date[:4]}_{date[5:7]}"
+
+async def create_bill_archive_partition(name: str):
+    try:
+        await db.create_collection(name, storageEngine={
+            "wiredTiger": {"configString": f"block_compressor={BILL_ARCHIVE_COMPRESSOR}"}
+        })
+    except CollectionInvalid:
+        return
+    await db[name].create_index("id", unique=True)
+    await db[name].create_index([("branch_id", 1), ("date", 1)])
+
+async def bill_archive_partitions(query: dict) -> List[str]:
+    """Archive partitions holding bills that match a query on date, oldest first"""
+    return sorted(await db.bill_archive.distinct("partition", query))
+
+async def find_archived_bill(bill_id: str, branch_id: str):
+    entry = await db.bill_archive.find_one({"id": bill_id, "branch_id": branch_id})
+    if not entry:
+        return None
+    return await db[entry["partition"]].find_one({"id": bill_id})
+
+async def archive_old_bills(older_than_days: int = BILL_ARCHIVE_AFTER_DAYS):
+    """Move bills from months that ended more than older_than_days ago into archive partitions.
+
+    Each batch is copied into its partition and indexed before it is removed
+    from bills, so an interrupted run leaves bills findable and the next run
+    picks up where it stopped.
+    """
+    older_than_days = max(older_than_days, FORECAST_HISTORY_DAYS)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    # Only whole months are archived, so a partition is written once
+    cutoff = cutoff.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
+    
+    archived = {}
+    while True:
+        batch = await db.bills.find({"date": {"$lt": cutoff}}, {"_id": 0}).sort("date", 1).to_list(length=BILL_ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        by_partition = {}
+        for bill in batch:
+            by_partition.setdefault(bill_archive_partition(bill["date"]), []).append(bill)
+        for partition, bills in by_partition.items():
+            await create_bill_archive_partition(partition)
+            await db[partition].bulk_write([
+                ReplaceOne({"id": bill["id"]}, bill, upsert=True) for bill in bills
+            ], ordered=False)
+            await db.bill_archive.bulk_write([
+                ReplaceOne({"id": bill["id"]}, {
+                    "id": bill["id"],
+                    "bill_number": bill["bill_number"],
+                    "branch_id": bill["branch_id"],
+                    "date": bill["date"],
+                    "partition": partition
+                }, upsert=True) for bill in bills
+            ], ordered=False)
+            archived[partition] = archived.get(partition, 0) + len(bills)
+        # By branch and id, so the deletes use the (branch_id, id) index
+        by_branch = {}
+        for bill in batch:
+            by_branch.setdefault(bill["branch_id"], []).append(bill["id"])
+        for branch_id, bill_ids in by_branch.items():
+            await db.bills.delete_many({"branch_id": branch_id, "id": {"$in": bill_ids}})
+    return archived
+
+async def run_bill_archive_periodically():
+    if BILL_ARCHIVE_AFTER_DAYS <= 0:
+        return
+    while True:
+        try:
+            if await acquire_lease("bill_archive", BILL_ARCHIVE_INTERVAL_SECONDS * 2):
+                archived = await archive_old_bills()
+                if archived:
+                    logger.info("Archived %d bills into %s", sum(archived.values()), ", ".join(archived))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Bill archival failed")
+        await asyncio.sleep(BILL_ARCHIVE_INTERVAL_SECONDS)
+
+# Receipts: rendered in the job process pool and cached in the receipts
+# collection under bill id, format and template version
+def receipt_cache_key(bill_id: str, format: str) -> str:
+    return f"{bill_id}:{format}:v{RECEIPT_TEMPLATE_VERSION}"
+
+async def cached_receipts(bills: List[dict], format: str) -> Dict[str, bytes]:
+    """Receipts for a batch of bills by bill id, rendering only those not cached yet"""
+    keys = {receipt_cache_key(bill["id"], format): bill for bill in bills}
+    cached = await db.receipts.find({"_id": {"$in": list(keys)}}).to_list(length=None)
+    receipts = {receipt["bill_id"]: receipt["content"] for receipt in cached}
+    missing = [bill for bill in bills if bill["id"] not in receipts]
+    if not missing:
+        return receipts
+    
+    loop = asyncio.get_running_loop()
+    rendered = await asyncio.gather(*(
+        loop.run_in_executor(job_runner.process_pool, partial(render_receipt, bill, format))
+        for bill in missing
+    ))
+    created_at = datetime.now(timezone.utc)
+    try:
+        await db.receipts.insert_many([{
+            "_id": receipt_cache_key(bill["id"], format),
+            "bill_id": bill["id"],
+            "format": format,
+            "template_version": RECEIPT_TEMPLATE_VERSION,
+            "content": content,
+            "created_at": created_at
+        } for bill, content in zip(missing, rendered)], ordered=False)
+    except BulkWriteError:
+        # Another request rendered some of them first; the content is the same
+        pass
+    receipts.update((bill["id"], content) for bill, content in zip(missing, rendered))
+    return receipts
 
 def prepare_for_mongo(data):
     """Convert datetime objects to ISO strings for MongoDB storage"""
@@ -169,44 +1706,163 @@ def prepare_for_mongo(data):
                 data[key] = value.isoformat()
     return data
 
+# Job Handlers
+EXPORT_BATCH_SIZE = 5000
+
+@job_runner.register("bills_export")
+async def export_bills(job: JobContext, params: dict):
+    """CSV export of a branch's bills, optionally limited to params start/end (ISO dates)"""
+    query = {"branch_id": params["branch_id"]}
+    if params.get("start") or params.get("end"):
+        query["date"] = {}
+        if params.get("start"):
+            query["date"]["$gte"] = params["start"]
+        if params.get("end"):
+            query["date"]["$lt"] = params["end"]
+    # Archived months first: they are all older than the hot bills
+    sources = [db[partition] for partition in await bill_archive_partitions(query)] + [db.bills]
+    total = 0
+    for source in sources:
+        total += await source.count_documents(query)
+    path = job.result_path(".csv")
+    
+    exported = 0
+    batch = []
+    with open(path, "w", newline="") as output:
+        output.write(await job.run_cpu(render_bills_csv, [], include_header=True))
+        for source in sources:
+            cursor = source.find(query, {"_id": 0}).sort("date", 1).batch_size(EXPORT_BATCH_SIZE)
+            async for bill in cursor:
+                batch.append(bill)
+                if len(batch) == EXPORT_BATCH_SIZE:
+                    output.write(await job.run_cpu(render_bills_csv, batch))
+                    exported += len(batch)
+                    batch = []
+                    await job.progress(exported / max(total, 1), f"{exported} of {total} bills")
+        if batch:
+            output.write(await job.run_cpu(render_bills_csv, batch))
+            exported += len(batch)
+    await job.progress(1.0, f"{exported} bills exported")
+    return path
+
+@job_runner.register("stock_snapshot")
+async def stock_snapshot_job(job: JobContext, params: dict):
+    snapshot = await take_stock_snapshot_now()
+    if snapshot is None:
+        raise RuntimeError("Another worker is taking a stock snapshot")
+    as_of, products = snapshot
+    await job.progress(1.0, f"Snapshot of {products} products as of {as_of.isoformat()}")
+
+@job_runner.register("demand_forecast")
+async def demand_forecast_job(job: JobContext, params: dict):
+    generated_at, products = await run_demand_forecast()
+    await job.progress(1.0, f"Forecast for {products} products generated at {generated_at.isoformat()}")
+
+@job_runner.register("receipts_batch")
+async def render_receipts_batch(job: JobContext, params: dict):
+    """Zip of a branch's receipts for reprinting, by params bill_ids or start/end (ISO dates)"""
+    format = params.get("format", "pdf")
+    if format not in RECEIPT_FORMATS:
+        raise ValueError(f"Unknown receipt format: {format}")
+    query = {"branch_id": params["branch_id"]}
+    if params.get("bill_ids"):
+        query["id"] = {"$in": params["bill_ids"]}
+    if params.get("start") or params.get("end"):
+        query["date"] = {}
+        if params.get("start"):
+            query["date"]["$gte"] = params["start"]
+        if params.get("end"):
+            query["date"]["$lt"] = params["end"]
+    total = await db.bills.count_documents(query)
+    path = job.result_path(".zip")
+    
+    rendered = 0
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        cursor = db.bills.find(query, {"_id": 0}).sort("date", 1).batch_size(RECEIPT_BATCH_SIZE)
+        batch = []
+        async for bill in cursor:
+            batch.append(bill)
+            if len(batch) < RECEIPT_BATCH_SIZE:
+                continue
+            receipts = await cached_receipts(batch, format)
+            for bill in batch:
+                archive.writestr(f"{bill['bill_number']}.{format}", receipts[bill["id"]])
+            rendered += len(batch)
+            batch = []
+            await job.progress(rendered / max(total, 1), f"{rendered} of {total} receipts")
+        if batch:
+            receipts = await cached_receipts(batch, format)
+            for bill in batch:
+                archive.writestr(f"{bill['bill_number']}.{format}", receipts[bill["id"]])
+            rendered += len(batch)
+    await job.progress(1.0, f"{rendered} receipts rendered")
+    return path
+
+@job_runner.register("bills_archive")
+async def bills_archive_job(job: JobContext, params: dict):
+    archived = await archive_old_bills(int(params.get("older_than_days", BILL_ARCHIVE_AFTER_DAYS)))
+    await job.progress(1.0, f"Archived {sum(archived.values())} bills into {len(archived)} partitions")
+
 # Authentication Routes
 @api_router.post("/auth/login")
-async def login(user_data: UserLogin):
-    user = await db.users.find_one({"username": user_data.username})
-    if not user or not verify_password(user_data.password, user["password"]):
+async def login(user_data: UserLogin, request: Request):
+    # Throttled attempts are turned away before any lookup or bcrypt work
+    throttle_login(request, user_data.username)
+    user = await find_user(user_data.username)
+    # bcrypt releases the GIL, so checking in a thread keeps the loop serving
+    if not user or not await asyncio.to_thread(verify_password, user_data.password, user["password"]):
+        LOGIN_ATTEMPTS_REJECTED.labels("invalid_credentials").inc()
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    access_token = create_access_token(data={"sub": user["username"]})
+    access_token = create_access_token(data={"sub": user["username"], "branch": user.get("branch_id", DEFAULT_BRANCH)})
     return {"access_token": access_token, "token_type": "bearer", "user": UserResponse(**user)}
 
 @api_router.post("/auth/register", response_model=UserResponse)
-async def register(user_data: UserLogin):
+async def register(user_data: UserLogin, branch_id: str = Depends(get_registering_branch)):
     # Check if user exists
     existing_user = await db.users.find_one({"username": user_data.username})
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
     # Create new user
-    user = User(username=user_data.username, password=hash_password(user_data.password))
+    user = User(username=user_data.username, password=await asyncio.to_thread(hash_password, user_data.password), branch_id=branch_id)
     user_dict = prepare_for_mongo(user.dict())
     await db.users.insert_one(user_dict)
+    # Drops a cached "no such user" for this name on every worker
+    await invalidation_bus.publish("users", user.username)
     return UserResponse(**user.dict())
 
+@api_router.post("/auth/change-password")
+async def change_password(password_data: PasswordChange, request: Request, current_user: str = Depends(get_current_user)):
+    throttle_login(request, current_user)
+    user = await find_user(current_user)
+    if not user or not await asyncio.to_thread(verify_password, password_data.current_password, user["password"]):
+        LOGIN_ATTEMPTS_REJECTED.labels("invalid_credentials").inc()
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    hashed = await asyncio.to_thread(hash_password, password_data.new_password)
+    await db.users.update_one({"username": current_user}, {"$set": {"password": hashed}})
+    await invalidation_bus.publish("users", current_user)
+    return {"message": "Password changed successfully"}
+
 # Dashboard Routes
-@api_router.get("/dashboard/stats", response_model=DashboardStats)
-async def get_dashboard_stats(current_user: str = Depends(get_current_user)):
-    # Get counts
-    total_products = await db.products.count_documents({})
+async def compute_dashboard_stats(branch_id: str) -> DashboardStats:
+    # Get counts; customers and categories are shared by every branch
+    total_products = await db.products.count_documents({"branch_id": branch_id})
     total_customers = await db.customers.count_documents({})
     total_categories = await db.categories.count_documents({})
-    total_bills = await db.bills.count_documents({})
+    total_bills = (await db.bills.count_documents({"branch_id": branch_id})
+                   + await db.bill_archive.count_documents({"branch_id": branch_id}))
     
     # Low stock products (quantity < 10)
-    low_stock_products = await db.products.count_documents({"quantity": {"$lt": 10}})
+    low_stock_products = await db.products.count_documents({"branch_id": branch_id, "quantity": {"$lt": LOW_STOCK_THRESHOLD}})
     
     # Today's sales
     today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_bills = await db.bills.find({"date": {"$gte": today.isoformat()}}).to_list(length=None)
+    today_bills = await db.bills.find(
+        {"branch_id": branch_id, "date": {"$gte": today.isoformat()}},
+        {"_id": 0, "total": 1}
+    ).to_list(length=None)
     today_sales = sum(bill.get("total", 0) for bill in today_bills)
     
     return DashboardStats(
@@ -218,17 +1874,66 @@ async def get_dashboard_stats(current_user: str = Depends(get_current_user)):
         today_sales=today_sales
     )
 
+@api_router.get("/dashboard/stats", response_model=DashboardStats)
+async def get_dashboard_stats(branch_id: str = Depends(get_current_branch)):
+    return await compute_dashboard_stats(branch_id)
+
+# Live Event Routes
+async def event_stream(queue, initial_frames):
+    try:
+        for frame in initial_frames:
+            yield frame
+        while True:
+            try:
+                frame = await asyncio.wait_for(queue.get(), timeout=EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if frame is None:
+                # Fell too far behind; the client reconnects with Last-Event-ID
+                return
+            yield frame
+    finally:
+        live_events.unsubscribe(queue)
+
+@api_router.get("/events/stream")
+async def stream_events(last_event_id: Optional[str] = Header(default=None), branch_id: str = Depends(get_stream_branch)):
+    """Server-Sent Events feed of the branch's dashboard stat deltas, new bills and low-stock transitions"""
+    resume_from = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    queue, missed = live_events.subscribe(branch_id, resume_from)
+    initial_frames = ["retry: 3000\n\n"]
+    if missed is None:
+        # New or out-of-range client: send a full snapshot to apply deltas to.
+        # Events published while it is computed are queued as well, so a delta
+        # may already be reflected in the snapshot but is never lost.
+        snapshot_id = live_events.last_id
+        stats = await compute_dashboard_stats(branch_id)
+        initial_frames.append(encode_event(snapshot_id, "snapshot", stats.model_dump()))
+    else:
+        initial_frames.extend(missed)
+    return StreamingResponse(
+        event_stream(queue, initial_frames),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Category Routes
 @api_router.get("/categories", response_model=List[Category])
 async def get_categories(current_user: str = Depends(get_current_user)):
-    categories = await db.categories.find().to_list(length=None)
-    return [Category(**category) for category in categories]
+    async def load():
+        categories = await db.categories.find().to_list(length=None)
+        return [Category(**category) for category in categories]
+    return await shared_cache.get("categories", "all", load)
 
 @api_router.post("/categories", response_model=Category)
 async def create_category(category_data: CategoryCreate, current_user: str = Depends(get_current_user)):
     category = Category(**category_data.dict())
     category_dict = prepare_for_mongo(category.dict())
     await db.categories.insert_one(category_dict)
+    await invalidation_bus.publish_batch(
+        invalidations=[("categories", None)],
+        events=[(None, "stats", {"total_categories": 1})]
+    )
     return category
 
 @api_router.put("/categories/{category_id}", response_model=Category)
@@ -239,6 +1944,9 @@ async def update_category(category_id: str, category_data: CategoryCreate, curre
     
     update_data = category_data.dict()
     await db.categories.update_one({"id": category_id}, {"$set": update_data})
+    await invalidation_bus.publish("categories")
+    # Product listings carry the category name
+    await invalidation_bus.publish("products")
     
     updated_category = await db.categories.find_one({"id": category_id})
     return Category(**updated_category)
@@ -253,12 +1961,25 @@ async def delete_category(category_id: str, current_user: str = Depends(get_curr
     result = await db.categories.delete_one({"id": category_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    await invalidation_bus.publish_batch(
+        invalidations=[("categories", None)],
+        events=[(None, "stats", {"total_categories": -1})]
+    )
     return {"message": "Category deleted successfully"}
 
 # Product Routes
-@api_router.get("/products", response_model=List[Product])
-async def get_products(current_user: str = Depends(get_current_user)):
+@api_router.get("/products", response_model=List[ProductListing])
+async def get_products(branch_id: str = Depends(get_current_branch)):
+    products = await shared_cache.get("products", branch_id, partial(load_products, branch_id))
+    held = await held_quantities(branch_id=branch_id)
+    return [
+        ProductListing(**product.dict(), available_quantity=product.quantity - held.get(product.id, 0))
+        for product in products
+    ]
+
+async def load_products(branch_id: str):
     products = await db.products.aggregate([
+        {"$match": {"branch_id": branch_id}},
         {
             "$lookup": {
                 "from": "categories",
@@ -279,23 +2000,27 @@ async def get_products(current_user: str = Depends(get_current_user)):
     return [Product(**product) for product in products]
 
 @api_router.post("/products", response_model=Product)
-async def create_product(product_data: ProductCreate, current_user: str = Depends(get_current_user)):
+async def create_product(product_data: ProductCreate, branch_id: str = Depends(get_current_branch)):
     # Verify category exists
     category = await db.categories.find_one({"id": product_data.category_id})
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    product = Product(**product_data.dict(), category_name=category["name"])
+    product = Product(**product_data.dict(), category_name=category["name"], branch_id=branch_id)
     product_dict = prepare_for_mongo(product.dict())
     await db.products.insert_one(product_dict)
+    await record_stock_movements([StockMovement(id=opening_movement_id(product.id), product_id=product.id, delta=product.quantity, reason="initial", branch_id=branch_id)])
+    await invalidation_bus.publish_batch(
+        invalidations=[("products", branch_id)],
+        events=[(branch_id, "stats", {
+            "total_products": 1,
+            "low_stock_products": 1 if product.quantity < LOW_STOCK_THRESHOLD else 0
+        })]
+    )
     return product
 
 @api_router.put("/products/{product_id}", response_model=Product)
-async def update_product(product_id: str, product_data: ProductUpdate, current_user: str = Depends(get_current_user)):
-    product = await db.products.find_one({"id": product_id})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
+async def update_product(product_id: str, product_data: ProductUpdate, current_user: str = Depends(get_current_user), branch_id: str = Depends(get_current_branch)):
     update_data = {k: v for k, v in product_data.dict().items() if v is not None}
     
     # If category is being updated, get category name
@@ -305,18 +2030,63 @@ async def update_product(product_id: str, product_data: ProductUpdate, current_u
             raise HTTPException(status_code=404, detail="Category not found")
         update_data["category_name"] = category["name"]
     
-    await db.products.update_one({"id": product_id}, {"$set": update_data})
+    # The ledger delta comes from the quantity this write replaced, so a sale
+    # landing between a read and the write cannot make the ledger drift
+    product = await db.products.find_one_and_update(
+        {"id": product_id, "branch_id": branch_id},
+        {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if update_data.get("quantity", product["quantity"]) != product["quantity"]:
+        await record_stock_movements([StockMovement(
+            product_id=product_id,
+            delta=update_data["quantity"] - product["quantity"],
+            reason="adjustment",
+            reference=current_user,
+            branch_id=branch_id
+        )])
     
-    updated_product = await db.products.find_one({"id": product_id})
+    updated_product = {**product, **update_data}
+    await invalidation_bus.publish_batch(
+        invalidations=[("products", branch_id)],
+        events=stock_change_events(updated_product, product["quantity"], updated_product["quantity"])
+    )
     return Product(**updated_product)
 
 @api_router.delete("/products/{product_id}")
-async def delete_product(product_id: str, current_user: str = Depends(get_current_user)):
-    result = await db.products.delete_one({"id": product_id})
-    if result.deleted_count == 0:
+async def delete_product(product_id: str, branch_id: str = Depends(get_current_branch)):
+    product = await db.products.find_one_and_delete({"id": product_id, "branch_id": branch_id})
+    if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    await record_stock_movements([StockMovement(product_id=product_id, delta=-product["quantity"], reason="removed", branch_id=branch_id)])
+    await invalidation_bus.publish_batch(
+        invalidations=[("products", branch_id)],
+        events=[(branch_id, "stats", {
+            "total_products": -1,
+            "low_stock_products": -1 if product["quantity"] < LOW_STOCK_THRESHOLD else 0
+        })]
+    )
     return {"message": "Product deleted successfully"}
 
+@api_router.get("/products/{product_id}/stock", response_model=StockLevel)
+async def get_product_stock(product_id: str, at: Optional[datetime] = None, branch_id: str = Depends(get_current_branch)):
+    """Stock level now, or at any past time, from the latest snapshot plus the ledger tail"""
+    # The ledger outlives deleted products, so it decides which branch a product is in
+    if not await db.stock_movements.find_one({"product_id": product_id, "branch_id": branch_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Product not found")
+    if at is None:
+        at = datetime.now(timezone.utc)
+    elif at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    return await stock_level_at(product_id, at)
+
+@api_router.get("/products/{product_id}/movements", response_model=List[StockMovement])
+async def get_product_movements(product_id: str, limit: int = 100, branch_id: str = Depends(get_current_branch)):
+    movements = await db.stock_movements.find({"product_id": product_id, "branch_id": branch_id}).sort("created_at", -1).to_list(length=limit)
+    return [StockMovement(**movement) for movement in movements]
+
 # Customer Routes
 @api_router.get("/customers", response_model=List[Customer])
 async def get_customers(current_user: str = Depends(get_current_user)):
@@ -328,6 +2098,7 @@ async def create_customer(customer_data: CustomerCreate, current_user: str = Dep
     customer = Customer(**customer_data.dict())
     customer_dict = prepare_for_mongo(customer.dict())
     await db.customers.insert_one(customer_dict)
+    await invalidation_bus.publish_batch(events=[(None, "stats", {"total_customers": 1})])
     return customer
 
 @api_router.put("/customers/{customer_id}", response_model=Customer)
@@ -347,34 +2118,270 @@ async def delete_customer(customer_id: str, current_user: str = Depends(get_curr
     result = await db.customers.delete_one({"id": customer_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
+    await invalidation_bus.publish_batch(events=[(None, "stats", {"total_customers": -1})])
     return {"message": "Customer deleted successfully"}
 
+# Inventory Routes
+@api_router.get("/inventory/reorder-suggestions", response_model=ReorderReport)
+async def get_reorder_suggestions(all: bool = False, limit: int = 500, branch_id: str = Depends(get_current_branch)):
+    """Latest forecast, most urgent (fewest days of cover) first"""
+    run = await latest_forecast_run()
+    if not run:
+        return ReorderReport(suggestions=[])
+    if all:
+        # Products without demand have no days of cover; list them last
+        suggestions = await db.reorder_suggestions.aggregate([
+            {"$match": {"branch_id": branch_id, "run_id": run.get("run_id")}},
+            {"$addFields": {"cover_order": {"$ifNull": ["$days_of_cover", float("inf")]}}},
+            {"$sort": {"cover_order": 1}},
+            {"$limit": limit}
+        ]).to_list(length=None)
+    else:
+        suggestions = await db.reorder_suggestions.find(
+            {"branch_id": branch_id, "run_id": run.get("run_id"), "needs_reorder": True}
+        ).sort("days_of_cover", 1).to_list(length=limit)
+    return ReorderReport(
+        generated_at=run["generated_at"],
+        suggestions=[ReorderSuggestion(**suggestion) for suggestion in suggestions]
+    )
+
+@api_router.post("/inventory/reorder-suggestions/refresh", response_model=Job)
+async def refresh_reorder_suggestions(current_user: str = Depends(get_current_user), branch_id: str = Depends(get_current_branch)):
+    """Queue a forecast run; follow it under /jobs/{id}"""
+    return await enqueue_job("demand_forecast", {}, current_user, branch_id)
+
+# Cart Routes
+@api_router.get("/carts/{cart_id}", response_model=Cart)
+async def get_cart(cart_id: str, branch_id: str = Depends(get_current_branch)):
+    holds = [StockHold(**hold) for hold in await active_holds({"branch_id": branch_id, "cart_id": cart_id})]
+    return Cart(
+        cart_id=cart_id,
+        items=holds,
+        expires_at=min((hold.expires_at for hold in holds), default=None)
+    )
+
+@api_router.put("/carts/{cart_id}/items/{product_id}", response_model=Cart)
+async def set_cart_item(cart_id: str, product_id: str, item: CartItemUpdate, branch_id: str = Depends(get_current_branch)):
+    """Hold a quantity of a product for the cart; quantity 0 releases the hold"""
+    product = await db.products.find_one({"id": product_id, "branch_id": branch_id})
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    key = {"branch_id": branch_id, "cart_id": cart_id, "product_id": product_id}
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=CART_HOLD_TTL_SECONDS)
+    if item.quantity == 0:
+        await db.holds.delete_one(key)
+    else:
+        hold = StockHold(
+            cart_id=cart_id,
+            product_id=product_id,
+            product_name=product["name"],
+            quantity=item.quantity,
+            expires_at=expires_at,
+            branch_id=branch_id
+        )
+        # Not prepare_for_mongo: expires_at must stay a date for the TTL index
+        new_fields = {k: v for k, v in hold.dict().items() if k not in ("quantity", "expires_at")}
+        existing = await db.holds.find_one_and_update(
+            key,
+            {"$set": {"quantity": item.quantity, "expires_at": expires_at}, "$setOnInsert": new_fields},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        
+        # Write first, then check: of two carts (or a cart and a bill) racing
+        # for the last units at least one sees both writes and backs out, so
+        # stock is never over-held
+        held, current = await asyncio.gather(
+            held_quantities([product_id], branch_id),
+            db.products.find_one({"id": product_id, "branch_id": branch_id}, {"quantity": 1})
+        )
+        if held.get(product_id, 0) > (current["quantity"] if current else 0):
+            if existing:
+                await db.holds.update_one(key, {"$set": {"quantity": existing["quantity"]}})
+            else:
+                await db.holds.delete_one(key)
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for product: {product['name']}")
+    
+    # Any change to the cart keeps all of its holds alive
+    await db.holds.update_many({"branch_id": branch_id, "cart_id": cart_id}, {"$set": {"expires_at": expires_at}})
+    return await get_cart(cart_id, branch_id)
+
+@api_router.delete("/carts/{cart_id}")
+async def release_cart(cart_id: str, branch_id: str = Depends(get_current_branch)):
+    await db.holds.delete_many({"branch_id": branch_id, "cart_id": cart_id})
+    return {"message": "Cart released successfully"}
+
 # Bill Routes
 @api_router.get("/bills", response_model=List[Bill])
-async def get_bills(current_user: str = Depends(get_current_user)):
-    bills = await db.bills.find().sort("date", -1).to_list(length=None)
+async def get_bills(branch_id: str = Depends(get_current_branch)):
+    bills = await db.bills.find({"branch_id": branch_id}).sort("date", -1).to_list(length=None)
     return [Bill(**bill) for bill in bills]
 
+BILL_SEARCH_MAX_PAGE_SIZE = 100
+# Bill number weight in the text index; exact number lookups score the same
+BILL_NUMBER_SCORE = 10.0
+# Shorter digit runs would match most contacts ("07...") and only look up bill numbers
+BILL_SEARCH_MIN_CONTACT_DIGITS = int(os.environ.get('BILL_SEARCH_MIN_CONTACT_DIGITS', '4'))
+BILL_SEARCH_MAX_QUERY_LENGTH = 200
+# ASCII digits only, and few enough that int() stays cheap and in range
+BILL_SEARCH_DIGITS = re.compile(r"[0-9]{1,18}")
+
+def bill_search_digits(q: str) -> Optional[str]:
+    """The digits of a query that is only a number, bill number prefix and separators aside; None otherwise"""
+    digits = re.sub(r"^INF[\s-]*(?:[A-Z][A-Z0-9]*[\s-]+)?|[\s-]", "", q, flags=re.IGNORECASE)
+    return digits if BILL_SEARCH_DIGITS.fullmatch(digits) else None
+
+def bill_search_numbers(branch_id: str, q: str, digits: str) -> List[str]:
+    """Bill numbers a number-only query matches exactly: as typed, and normalized for the branch"""
+    return [q.upper(), format_bill_number(branch_id, int(digits))]
+
+@api_router.get("/bills/search", response_model=BillSearchPage)
+async def search_bills(
+    q: str = Query(..., max_length=BILL_SEARCH_MAX_QUERY_LENGTH),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=BILL_SEARCH_MAX_PAGE_SIZE),
+    branch_id: str = Depends(get_current_branch)
+):
+    """Find bills by customer name or contact, product name or bill number, best matches first.
+
+    Queries that are only a number (a bill number with or without its INF-
+    prefix and padding, or the start of a phone number) are exact and prefix
+    lookups on their own indexes, which also reach archived bills by number.
+    Exact bill number hits come first, then bills whose contact starts with
+    the number, by contact and newest first. Anything else is a text search
+    over the bill_search index.
+    """
+    q = q.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    query = {"branch_id": branch_id}
+    if start or end:
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = (start if start.tzinfo else start.replace(tzinfo=timezone.utc)).isoformat()
+        if end:
+            query["date"]["$lt"] = (end if end.tzinfo else end.replace(tzinfo=timezone.utc)).isoformat()
+    skip = (page - 1) * page_size
+    
+    digits = bill_search_digits(q)
+    if digits:
+        # Exact hits are a handful at most, so every page looks them up and
+        # pages over them followed by the contact matches
+        bill_numbers = bill_search_numbers(branch_id, q, digits)
+        exact = await db.bills.find({**query, "bill_number": {"$in": bill_numbers}}, {"_id": 0}).to_list(length=None)
+        for archived in await db.bill_archive.find({**query, "bill_number": {"$in": bill_numbers}}).to_list(length=None):
+            bill = await db[archived["partition"]].find_one({"id": archived["id"]}, {"_id": 0})
+            if bill:
+                exact.append(bill)
+        exact.sort(key=lambda bill: bill["date"], reverse=True)
+        hits = [{**bill, "score": BILL_NUMBER_SCORE} for bill in exact[skip:skip + page_size + 1]]
+        wanted = page_size + 1 - len(hits)
+        if wanted and len(digits) >= BILL_SEARCH_MIN_CONTACT_DIGITS:
+            contacts = await db.bills.find(
+                {**query, "customer_contact": {"$regex": f"^{digits}"}, "id": {"$nin": [bill["id"] for bill in exact]}},
+                {"_id": 0}
+            ).sort([("customer_contact", 1), ("date", -1)]).skip(max(skip - len(exact), 0)).limit(wanted).to_list(length=None)
+            hits.extend({**bill, "score": 1.0} for bill in contacts)
+    else:
+        query["$text"] = {"$search": q}
+        hits = await db.bills.find(
+            query,
+            {"_id": 0, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"}), ("date", -1)]).skip(skip).limit(page_size + 1).to_list(length=None)
+    
+    return BillSearchPage(
+        page=page,
+        page_size=page_size,
+        has_more=len(hits) > page_size,
+        results=[BillSearchHit(**hit) for hit in hits[:page_size]]
+    )
+
 @api_router.post("/bills", response_model=Bill)
-async def create_bill(bill_data: BillCreate, current_user: str = Depends(get_current_user)):
-    # Get customer
-    customer = await db.customers.find_one({"id": bill_data.customer_id})
+async def create_bill(bill_data: BillCreate, branch_id: str = Depends(get_current_branch)):
+    # Held stock is already reserved for its cart; anything else can only be
+    # sold from stock that no active cart is holding
+    claimed = []
+    if bill_data.cart_id:
+        customer, holds = await asyncio.gather(
+            db.customers.find_one({"id": bill_data.customer_id}),
+            active_holds({"branch_id": branch_id, "cart_id": bill_data.cart_id})
+        )
+        if customer and holds:
+            # Claim the holds before touching stock: of two checkouts of the
+            # same cart only one gets them, and it bills only what it claimed
+            now = datetime.now(timezone.utc)
+            claimed = [hold for hold in await asyncio.gather(*(
+                db.holds.find_one_and_delete({"id": hold["id"], "expires_at": {"$gt": now}})
+                for hold in holds
+            )) if hold]
+            if len(claimed) < len(holds):
+                await restore_holds(claimed)
+                raise HTTPException(status_code=409, detail="Cart is already being checked out or its holds have expired")
+        requested = [{"product_id": hold["product_id"], "quantity": hold["quantity"]} for hold in claimed]
+        held = {}
+    elif bill_data.items:
+        requested = [item.dict() for item in bill_data.items]
+        customer, held = await asyncio.gather(
+            db.customers.find_one({"id": bill_data.customer_id}),
+            held_quantities([item["product_id"] for item in requested], branch_id)
+        )
+    else:
+        raise HTTPException(status_code=400, detail="Bill has no items")
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
+    if not requested:
+        raise HTTPException(status_code=409, detail="Cart is empty or its holds have expired")
+    
+    # Take every item's stock with a conditional decrement, all at once: the
+    # filter only matches while enough unheld stock is left, so concurrent
+    # bills can never take stock below zero or below what carts hold
+    products = await asyncio.gather(*(
+        db.products.find_one_and_update(
+            {
+                "id": item_data["product_id"],
+                "branch_id": branch_id,
+                "quantity": {"$gte": item_data["quantity"] + held.get(item_data["product_id"], 0)}
+            },
+            {"$inc": {"quantity": -item_data["quantity"]}},
+            return_document=ReturnDocument.BEFORE
+        )
+        for item_data in requested
+    ))
+    taken = [(item_data, product) for item_data, product in zip(requested, products) if product]
+    
+    async def release_stock():
+        if taken:
+            await db.products.bulk_write([
+                UpdateOne({"id": product["id"], "branch_id": branch_id}, {"$inc": {"quantity": item_data["quantity"]}})
+                for item_data, product in taken
+            ], ordered=False)
+    
+    if len(taken) < len(requested):
+        await asyncio.gather(release_stock(), restore_holds(claimed))
+        missing = next(item_data for item_data, product in zip(requested, products) if not product)
+        product = await db.products.find_one({"id": missing["product_id"], "branch_id": branch_id})
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product not found: {missing['product_id']}")
+        raise HTTPException(status_code=400, detail=f"Insufficient stock for product: {product['name']}")
+    
+    if not bill_data.cart_id:
+        # Holds placed after held was read check against the new stock
+        # themselves; this catches the ones that checked before it changed
+        now_held = await held_quantities([item_data["product_id"] for item_data in requested], branch_id)
+        for item_data, product in taken:
+            if product["quantity"] - item_data["quantity"] < now_held.get(product["id"], 0):
+                await release_stock()
+                raise HTTPException(status_code=400, detail=f"Insufficient stock for product: {product['name']}")
     
     # Process items and calculate total
     bill_items = []
     total = 0
-    
-    for item_data in bill_data.items:
-        product = await db.products.find_one({"id": item_data["product_id"]})
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product not found: {item_data['product_id']}")
-        
+    stock_changes = []
+    for item_data, product in taken:
         quantity = item_data["quantity"]
-        if product["quantity"] < quantity:
-            raise HTTPException(status_code=400, detail=f"Insufficient stock for product: {product['name']}")
-        
         subtotal = product["price"] * quantity
         bill_items.append(BillItem(
             product_id=product["id"],
@@ -384,16 +2391,10 @@ async def create_bill(bill_data: BillCreate, current_user: str = Depends(get_cur
             subtotal=subtotal
         ))
         total += subtotal
-        
-        # Update product quantity
-        await db.products.update_one(
-            {"id": product["id"]},
-            {"$inc": {"quantity": -quantity}}
-        )
+        stock_changes.append((product, product["quantity"], product["quantity"] - quantity))
     
     # Generate bill number
-    bill_count = await db.bills.count_documents({}) + 1
-    bill_number = f"INF-{bill_count:05d}"
+    bill_number = await next_bill_number(branch_id)
     
     bill = Bill(
         bill_number=bill_number,
@@ -401,20 +2402,142 @@ async def create_bill(bill_data: BillCreate, current_user: str = Depends(get_cur
         customer_name=customer["name"],
         customer_contact=customer["contact"],
         items=bill_items,
-        total=total
+        total=total,
+        branch_id=branch_id
     )
     
     bill_dict = prepare_for_mongo(bill.dict())
-    await db.bills.insert_one(bill_dict)
+    # Stock levels changed
+    events = [
+        (branch_id, "stats", {"total_bills": 1, "today_sales": total}),
+        (branch_id, "bill", {
+            "id": bill.id,
+            "bill_number": bill.bill_number,
+            "customer_name": bill.customer_name,
+            "total": bill.total,
+            "date": bill.date.isoformat()
+        }),
+    ]
+    for product, old_quantity, new_quantity in stock_changes:
+        events.extend(stock_change_events(product, old_quantity, new_quantity))
+    # The remaining writes are independent of each other
+    writes = [
+        db.bills.insert_one(bill_dict),
+        record_stock_movements([
+            StockMovement(product_id=item.product_id, delta=-item.quantity, reason="sale", reference=bill.id, branch_id=branch_id)
+            for item in bill_items
+        ])
+    ]
+    await asyncio.gather(*writes)
+    # Announced once the bill can be fetched
+    await invalidation_bus.publish_batch(invalidations=[("products", branch_id)], events=events)
     return bill
 
 @api_router.get("/bills/{bill_id}", response_model=Bill)
-async def get_bill(bill_id: str, current_user: str = Depends(get_current_user)):
-    bill = await db.bills.find_one({"id": bill_id})
+async def get_bill(bill_id: str, branch_id: str = Depends(get_current_branch)):
+    bill = await db.bills.find_one({"branch_id": branch_id, "id": bill_id})
+    if not bill:
+        bill = await find_archived_bill(bill_id, branch_id)
     if not bill:
         raise HTTPException(status_code=404, detail="Bill not found")
     return Bill(**bill)
 
+@api_router.get("/bills/{bill_id}/receipt")
+async def get_bill_receipt(
+    bill_id: str,
+    format: str = Query("html", pattern="^(html|pdf)$"),
+    if_none_match: Optional[str] = Header(default=None),
+    branch_id: str = Depends(get_current_branch)
+):
+    """Printable receipt for a bill, rendered once per template version"""
+    etag = f'"{receipt_cache_key(bill_id, format)}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    bill = await get_bill(bill_id, branch_id)
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    
+    receipts = await cached_receipts([bill.dict()], format)
+    if format == "pdf":
+        headers["Content-Disposition"] = f'inline; filename="{bill.bill_number}.pdf"'
+    return Response(receipts[bill_id], media_type=RECEIPT_FORMATS[format], headers=headers)
+
+# Job Routes
+async def enqueue_job(job_type: str, params: dict, current_user: str, branch_id: str) -> Job:
+    # Branch-scoped handlers only ever see the caller's own branch
+    job = Job(
+        type=job_type,
+        params={**params, "branch_id": branch_id},
+        created_by=current_user,
+        branch_id=branch_id,
+        worker=job_runner.worker
+    )
+    await db.jobs.insert_one(prepare_for_mongo(job.dict()))
+    job_runner.submit(job.id, job.type, job.params)
+    return job
+
+@api_router.post("/jobs", response_model=Job)
+async def create_job(job_data: JobCreate, current_user: str = Depends(get_current_user), branch_id: str = Depends(get_current_branch)):
+    if job_data.type not in job_runner.handlers:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {job_data.type}")
+    return await enqueue_job(job_data.type, job_data.params, current_user, branch_id)
+
+@api_router.get("/jobs", response_model=List[Job])
+async def get_jobs(limit: int = 50, branch_id: str = Depends(get_current_branch)):
+    jobs = await db.jobs.find({"branch_id": branch_id}).sort("created_at", -1).to_list(length=limit)
+    return [Job(**job) for job in jobs]
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, branch_id: str = Depends(get_current_branch)):
+    job = await db.jobs.find_one({"id": job_id, "branch_id": branch_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Job(**job)
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str, branch_id: str = Depends(get_current_branch)):
+    job = await db.jobs.find_one({"id": job_id, "branch_id": branch_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("queued", "running"):
+        await job_runner.cancel(job_id)
+    return await get_job(job_id, branch_id)
+
+@api_router.get("/jobs/{job_id}/result")
+async def download_job_result(job_id: str, branch_id: str = Depends(get_current_branch)):
+    job = await db.jobs.find_one({"id": job_id, "branch_id": branch_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "succeeded" or not job.get("result_file"):
+        raise HTTPException(status_code=409, detail="Job has no result to download")
+    path = Path(job["result_file"])
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Job result is no longer available")
+    return FileResponse(path, filename=f"{job['type']}-{job_id}{path.suffix}")
+
+# Admin Routes
+@api_router.get("/admin/slow-query-log", response_model=SlowQueryLogSettings)
+async def get_slow_query_log(current_user: str = Depends(get_current_user)):
+    # Read the shared settings rather than whatever this worker last applied
+    await slow_query_log.load(db)
+    return SlowQueryLogSettings(**slow_query_log.settings())
+
+@api_router.put("/admin/slow-query-log", response_model=SlowQueryLogSettings)
+async def update_slow_query_log(settings: SlowQueryLogUpdate, current_user: str = Depends(get_current_user)):
+    changes = {key: value for key, value in settings.dict().items() if value is not None}
+    if changes:
+        await slow_query_log.update(db, changes)
+        # Other workers reload the settings when this arrives
+        await invalidation_bus.publish("settings", SlowQueryLog.SETTINGS_ID)
+    return SlowQueryLogSettings(**slow_query_log.settings())
+
+@api_router.post("/admin/stock-snapshots")
+async def create_stock_snapshot(current_user: str = Depends(get_current_user)):
+    snapshot = await take_stock_snapshot_now()
+    if snapshot is None:
+        raise HTTPException(status_code=409, detail="Another worker is taking a stock snapshot")
+    as_of, products = snapshot
+    return {"as_of": as_of, "products": products}
+
 # Initialize sample data
 @api_router.post("/init-data")
 async def initialize_sample_data():
@@ -469,10 +2592,13 @@ async def initialize_sample_data():
         {"name": "Art Sketchbook A3", "category_id": categories[3].id, "price": 600.0, "quantity": 30, "image_url": product_images[3], "description": "High-quality drawing paper for sketching and artwork"}
     ]
     
+    movements = []
     for prod_data in products_data:
         product = Product(**prod_data)
         prod_dict = prepare_for_mongo(product.dict())
         await db.products.insert_one(prod_dict)
+        movements.append(StockMovement(id=opening_movement_id(product.id), product_id=product.id, delta=product.quantity, reason="initial"))
+    await record_stock_movements(movements)
     
     # Create sample customers
     customers_data = [
@@ -488,6 +2614,9 @@ async def initialize_sample_data():
         cust_dict = prepare_for_mongo(customer.dict())
         await db.customers.insert_one(cust_dict)
     
+    await invalidation_bus.publish("users", "admin")
+    await invalidation_bus.publish("categories")
+    await invalidation_bus.publish("products")
     return {"message": "Sample data initialized successfully", "admin_credentials": {"username": "admin", "password": "admin123"}}
 
 # Include the router in the main app
@@ -500,6 +2629,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestMetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -508,6 +2638,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/ready", include_in_schema=False)
+async def readiness():
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    try:
+        await client.admin.command("ping")
+    except Exception:
+        return JSONResponse(status_code=503, content={"status": "database unavailable"})
+    return {"status": "ready"}
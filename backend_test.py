@@ -6,12 +6,13 @@ Tests all backend APIs for the billing system
 
 import requests
 import json
+import os
 import sys
 from datetime import datetime
 import time
 
 # Configuration
-BASE_URL = "https://bookstore-manager-1.preview.emergentagent.com/api"
+BASE_URL = os.environ.get("BACKEND_URL", "https://bookstore-manager-1.preview.emergentagent.com/api")
 ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD = "admin123"
 
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+INFINITY Bookshop Backend Load Testing Suite
+Starts the API locally, seeds it and runs concurrent scenarios against it,
+reporting throughput and latency percentiles per endpoint.
+
+    python load_test.py                      # in-memory database stand-in
+    python load_test.py --mongo mongodb://localhost:27017
+    python load_test.py --save-baseline      # record the current numbers
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+ADMIN_USERNAME = "admin"
+ADMIN_PASSWORD = "admin123"
+DEFAULT_BASELINE = ROOT_DIR / "load_test_baseline.json"
+
+# The backend configures INFO logging, which would log every client request
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadTestRecorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.elapsed = {}
+        self._scenario_endpoints = set()
+
+    def record(self, endpoint, seconds, ok):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        self._scenario_endpoints.add(endpoint)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def finish_scenario(self, elapsed):
+        # Throughput is over the time of the scenarios that hit the endpoint,
+        # not the whole run
+        for endpoint in self._scenario_endpoints:
+            self.elapsed[endpoint] = self.elapsed.get(endpoint, 0.0) + elapsed
+        self._scenario_endpoints.clear()
+
+    def summary(self):
+        results = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            results[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(values) / self.elapsed[endpoint], 2),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            }
+        return results
+
+
+class BookshopLoadTester:
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.http = httpx.AsyncClient(base_url=base_url, timeout=60, limits=httpx.Limits(max_connections=None))
+        self.headers = {}
+        self.product_ids = []
+        self.customer_ids = []
+        self.bill_ids = []
+
+    async def close(self):
+        await self.http.aclose()
+
+    async def request(self, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, path, headers=self.headers, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.recorder.record(endpoint, time.perf_counter() - start, ok)
+        return response
+
+    async def authenticate(self):
+        response = await self.http.post("/api/auth/login", json={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        self.product_ids = [p["id"] for p in (await self.http.get("/api/products", headers=self.headers)).json()]
+        self.customer_ids = [c["id"] for c in (await self.http.get("/api/customers", headers=self.headers)).json()]
+        self.bill_ids = [b["id"] for b in (await self.http.get("/api/bills", headers=self.headers)).json()[:500]]
+
+    # Scenarios: each call is one user iteration
+    async def login_storm(self):
+        await self.request("POST /api/auth/login", "POST", "/api/auth/login",
+                           json={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+
+    async def catalog_browsing(self):
+        await self.request("GET /api/categories", "GET", "/api/categories")
+        await self.request("GET /api/products", "GET", "/api/products")
+
+    async def checkout(self):
+        items = [{"product_id": product_id, "quantity": random.randint(1, 3)}
+                 for product_id in random.sample(self.product_ids, random.randint(1, 5))]
+        response = await self.request("POST /api/bills", "POST", "/api/bills",
+                                      json={"customer_id": random.choice(self.customer_ids), "items": items})
+        if response is not None and response.status_code == 200:
+            await self.request("GET /api/bills/{bill_id}", "GET", f"/api/bills/{response.json()['id']}")
+
+    async def dashboard_polling(self):
+        await self.request("GET /api/dashboard/stats", "GET", "/api/dashboard/stats")
+        if self.bill_ids:
+            await self.request("GET /api/bills/{bill_id}", "GET", f"/api/bills/{random.choice(self.bill_ids)}")
+
+
+SCENARIOS = ["login_storm", "catalog_browsing", "checkout", "dashboard_polling"]
+
+
+async def run_scenario(tester, name, concurrency, duration):
+    scenario = getattr(tester, name)
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            await scenario()
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    tester.recorder.finish_scenario(time.perf_counter() - start)
+
+
+async def seed_database(db, products, customers, bills):
+    """Seed realistic volumes directly through the driver using the API's own models"""
+    import server
+
+    admin = server.User(username=ADMIN_USERNAME, password=server.hash_password(ADMIN_PASSWORD))
+    await db.users.insert_one(server.prepare_for_mongo(admin.dict()))
+
+    categories = [server.Category(name=f"Category {i}", description="Load test category") for i in range(20)]
+    await db.categories.insert_many([server.prepare_for_mongo(c.dict()) for c in categories])
+
+    product_docs = []
+    for i in range(products):
+        category = random.choice(categories)
+        product = server.Product(
+            name=f"Product {i}",
+            category_id=category.id,
+            category_name=category.name,
+            price=round(random.uniform(50, 5000), 2),
+            # Enough stock that checkouts keep succeeding for the whole run
+            quantity=random.randint(5000, 20000),
+            description="Load test product"
+        )
+        product_docs.append(server.prepare_for_mongo(product.dict()))
+    await db.products.insert_many(product_docs)
+
+    customer_docs = [
+        server.prepare_for_mongo(server.Customer(name=f"Customer {i}", contact=f"07{i:08d}").dict())
+        for i in range(customers)
+    ]
+    await db.customers.insert_many(customer_docs)
+
+    now = datetime.now(timezone.utc)
+    bill_docs = []
+    for i in range(bills):
+        customer = random.choice(customer_docs)
+        items = []
+        for product in random.sample(product_docs, random.randint(1, 5)):
+            quantity = random.randint(1, 3)
+            items.append(server.BillItem(
+                product_id=product["id"],
+                product_name=product["name"],
+                quantity=quantity,
+                price=product["price"],
+                subtotal=product["price"] * quantity
+            ))
+        bill = server.Bill(
+            bill_number=f"INF-{i + 1:05d}",
+            customer_id=customer["id"],
+            customer_name=customer["name"],
+            customer_contact=customer["contact"],
+            date=now - timedelta(minutes=random.randint(0, 90 * 24 * 60)),
+            items=items,
+            total=sum(item.subtotal for item in items)
+        )
+        bill_docs.append(server.prepare_for_mongo(bill.dict()))
+    if bill_docs:
+        await db.bills.insert_many(bill_docs)
+        # Bills created during the run continue after the seeded numbers
+        await db.counters.update_one(
+            {"_id": server.bill_sequence(server.DEFAULT_BRANCH)}, {"$max": {"seq": bills}}, upsert=True
+        )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_local_server(args):
+    os.environ["MONGO_URL"] = args.mongo if args.mongo != "memory" else "mongodb://localhost:27017"
+    os.environ["DB_NAME"] = args.db_name
+    # login_storm measures the login path itself, not the brute-force throttle
+    os.environ.setdefault("LOGIN_USER_RATE_PER_MINUTE", "1000000")
+    os.environ.setdefault("LOGIN_USER_BURST", "1000000")
+    os.environ.setdefault("LOGIN_IP_RATE_PER_MINUTE", "1000000")
+    os.environ.setdefault("LOGIN_IP_BURST", "1000000")
+    import server
+
+    if args.mongo == "memory":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("The in-memory database needs mongomock-motor: pip install mongomock-motor")
+        memory_client = AsyncMongoMockClient()
+        server.AsyncIOMotorClient = lambda *args, **kwargs: memory_client
+
+    port = free_port()
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning")
+    local_server = uvicorn.Server(config)
+    task = asyncio.create_task(local_server.serve())
+    while not local_server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+
+    await seed_database(server.db, args.products, args.customers, args.bills)
+    return f"http://127.0.0.1:{port}", local_server, task
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Return the regressions of results against a stored baseline"""
+    regressions = []
+    for endpoint, current in results.items():
+        previous = baseline.get(endpoint)
+        if previous is None:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{endpoint}: {metric} {current[metric]} > baseline {previous[metric]}")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: throughput {current['throughput_rps']} < baseline {previous['throughput_rps']}")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{endpoint}: errors {current['errors']} > baseline {previous['errors']}")
+    return regressions
+
+
+def print_report(results):
+    print(f"\n{'Endpoint':<32}{'reqs':>8}{'errs':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, r in results.items():
+        print(f"{endpoint:<32}{r['requests']:>8}{r['errors']:>6}{r['throughput_rps']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+async def main(args):
+    random.seed(args.seed)
+    local_server = task = None
+    if args.url:
+        base_url = args.url
+    else:
+        base_url, local_server, task = await start_local_server(args)
+
+    recorder = LoadTestRecorder()
+    tester = BookshopLoadTester(base_url, recorder)
+    try:
+        await tester.authenticate()
+        for name in args.scenarios:
+            print(f"=== Running {name} ({args.concurrency} users, {args.duration}s) ===")
+            await run_scenario(tester, name, args.concurrency, args.duration)
+        results = recorder.summary()
+    finally:
+        await tester.close()
+        if local_server is not None:
+            import server
+            await server.client.drop_database(args.db_name)
+            local_server.should_exit = True
+            await task
+
+    print_report(results)
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"\nBaseline saved to {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"\nNo baseline at {baseline_path}; run with --save-baseline to record one")
+        return 0
+
+    regressions = compare_with_baseline(results, json.loads(baseline_path.read_text()), args.tolerance)
+    if regressions:
+        print("\n❌ Regressions against baseline:")
+        for regression in regressions:
+            print(f"   {regression}")
+        return 1
+    print("\n✅ No regressions against baseline")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Load test an already running backend instead of starting one")
+    parser.add_argument("--mongo", default="memory", help="MongoDB URL for the local backend, or 'memory'")
+    parser.add_argument("--db-name", default=f"bookshop_loadtest_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--bills", type=int, default=20000)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,23 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend runs from its own directory and imports its modules directly
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# server.py reads these at import time; nothing here connects to them
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "infinity_bookshop_test")
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """server.db backed by an in-memory mongomock database"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server
+    # Like the server's own client, dates come back timezone-aware
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["infinity_bookshop_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import Bill
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def archive_db(db, monkeypatch):
+    """The db fixture, with partitions created without their storage options, which mongomock lacks"""
+    create_collection = db.create_collection
+    async def create_plain_collection(name, **options):
+        return await create_collection(name)
+    monkeypatch.setattr(db, "create_collection", create_plain_collection)
+    return db
+
+
+async def add_bill(db, number, days_ago, branch_id="main"):
+    bill = Bill(
+        bill_number=server.format_bill_number(branch_id, number),
+        customer_id="c",
+        customer_name="Amal Perera",
+        customer_contact="0771234567",
+        date=datetime.now(timezone.utc) - timedelta(days=days_ago),
+        items=[],
+        total=0,
+        branch_id=branch_id
+    )
+    await db.bills.insert_one(server.prepare_for_mongo(bill.dict()))
+    return bill
+
+
+def test_partitions_are_named_by_month():
+    assert server.bill_archive_partition("2024-03-31T23:59:59+00:00") == "bills_archive_2024_03"
+    assert server.bill_archive_partition("2024-12-01T00:00:00+00:00") == "bills_archive_2024_12"
+
+
+def test_old_bills_move_to_their_month_and_stay_findable(archive_db):
+    async def scenario():
+        old, older, recent = await add_bill(archive_db, 1, 500), await add_bill(archive_db, 2, 540), await add_bill(archive_db, 3, 10)
+        archived = await server.archive_old_bills(365)
+
+        assert sum(archived.values()) == 2
+        assert [bill["id"] for bill in await archive_db.bills.find({}).to_list(None)] == [recent.id]
+        for bill in (old, older):
+            partition = server.bill_archive_partition(server.prepare_for_mongo(bill.dict())["date"])
+            assert await archive_db[partition].find_one({"id": bill.id})
+            assert (await server.get_bill(bill.id, "main")).bill_number == bill.bill_number
+        assert await server.bill_archive_partitions({"branch_id": "main"}) == sorted(archived)
+    run(scenario())
+
+
+def test_archived_bills_stay_in_their_branch(archive_db):
+    async def scenario():
+        bill = await add_bill(archive_db, 1, 500, branch_id="north")
+        await server.archive_old_bills(365)
+        assert await server.find_archived_bill(bill.id, "main") is None
+        with pytest.raises(HTTPException) as error:
+            await server.get_bill(bill.id, "main")
+        assert error.value.status_code == 404
+        assert (await server.get_bill(bill.id, "north")).id == bill.id
+    run(scenario())
+
+
+def test_an_interrupted_run_is_finished_by_the_next(archive_db):
+    async def scenario():
+        bill = await add_bill(archive_db, 1, 500)
+        await server.archive_old_bills(365)
+        # As if the previous run had copied the bill but not removed it yet
+        await add_bill(archive_db, 2, 500)
+        copied = await archive_db.bills.find_one({"bill_number": "INF-00002"}, {"_id": 0})
+        partition = server.bill_archive_partition(copied["date"])
+        await archive_db[partition].insert_one(dict(copied))
+
+        await server.archive_old_bills(365)
+        assert await archive_db.bills.count_documents({}) == 0
+        assert await archive_db[partition].count_documents({"id": copied["id"]}) == 1
+        assert await archive_db.bill_archive.count_documents({}) == 2
+        assert await server.find_archived_bill(bill.id, "main")
+    run(scenario())
+
+
+def test_bill_numbers_are_not_reused_after_archiving(archive_db):
+    async def scenario():
+        for number in (1, 2):
+            await add_bill(archive_db, number, 500)
+        await add_bill(archive_db, 3, 10)
+        await server.archive_old_bills(365)
+        await server.ensure_bill_sequence()
+        assert await server.next_bill_number("main") == "INF-00004"
+    run(scenario())
+
+
+def test_bill_number_search_reaches_archived_bills(archive_db):
+    async def scenario():
+        bill = await add_bill(archive_db, 7, 500)
+        await server.archive_old_bills(365)
+        page = await server.search_bills(q="INF-7", start=None, end=None, page=1, page_size=20, branch_id="main")
+        assert [hit.id for hit in page.results] == [bill.id]
+    run(scenario())
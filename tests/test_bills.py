@@ -0,0 +1,169 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+import server
+from server import BillCreate, Customer, Product, StockHold
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def add_product(db, quantity=50, price=100.0, branch_id="main"):
+    product = Product(name="Atlas", category_id="c", category_name="Maps", price=price, quantity=quantity, branch_id=branch_id)
+    await db.products.insert_one(server.prepare_for_mongo(product.dict()))
+    return product
+
+
+async def add_customer(db):
+    customer = Customer(name="Amal Perera", contact="0771234567")
+    await db.customers.insert_one(server.prepare_for_mongo(customer.dict()))
+    return customer
+
+
+async def hold(db, product, quantity, cart_id="cart"):
+    stock_hold = StockHold(
+        cart_id=cart_id,
+        product_id=product.id,
+        product_name=product.name,
+        quantity=quantity,
+        expires_at=server.datetime.now(server.timezone.utc) + server.timedelta(minutes=5),
+        branch_id=product.branch_id
+    )
+    await db.holds.insert_one(stock_hold.dict())
+
+
+async def quantity(db, product):
+    return (await db.products.find_one({"id": product.id}))["quantity"]
+
+
+def test_walk_in_bill_takes_stock_and_records_the_sale(db):
+    async def scenario():
+        product, customer = await add_product(db), await add_customer(db)
+        bill = await server.create_bill(BillCreate(customer_id=customer.id, items=[{"product_id": product.id, "quantity": 3}]), "main")
+        assert bill.total == 300
+        assert await quantity(db, product) == 47
+        movements = await db.stock_movements.find({"product_id": product.id}).to_list(None)
+        assert [(m["reason"], m["delta"]) for m in movements] == [("sale", -3)]
+    run(scenario())
+
+
+def test_quantities_must_be_positive():
+    with pytest.raises(ValidationError):
+        BillCreate(customer_id="c", items=[{"product_id": "p", "quantity": -2}])
+    with pytest.raises(ValidationError):
+        BillCreate(customer_id="c", items=[{"product_id": "p", "quantity": 0}])
+
+
+def test_held_stock_cannot_be_sold_to_walk_ins(db):
+    async def scenario():
+        product, customer = await add_product(db, quantity=5), await add_customer(db)
+        await hold(db, product, 4)
+        with pytest.raises(HTTPException) as error:
+            await server.create_bill(BillCreate(customer_id=customer.id, items=[{"product_id": product.id, "quantity": 2}]), "main")
+        assert error.value.status_code == 400
+        assert await quantity(db, product) == 5
+    run(scenario())
+
+
+def test_failed_item_puts_back_the_items_already_taken(db):
+    async def scenario():
+        plenty, scarce = await add_product(db, quantity=50), await add_product(db, quantity=1)
+        customer = await add_customer(db)
+        items = [{"product_id": plenty.id, "quantity": 5}, {"product_id": scarce.id, "quantity": 2}]
+        with pytest.raises(HTTPException) as error:
+            await server.create_bill(BillCreate(customer_id=customer.id, items=items), "main")
+        assert error.value.status_code == 400
+        assert (await quantity(db, plenty), await quantity(db, scarce)) == (50, 1)
+
+        items = [{"product_id": plenty.id, "quantity": 5}, {"product_id": "missing", "quantity": 1}]
+        with pytest.raises(HTTPException) as error:
+            await server.create_bill(BillCreate(customer_id=customer.id, items=items), "main")
+        assert error.value.status_code == 404
+        assert await quantity(db, plenty) == 50
+    run(scenario())
+
+
+def test_other_branches_products_cannot_be_billed(db):
+    async def scenario():
+        product, customer = await add_product(db, branch_id="kandy"), await add_customer(db)
+        with pytest.raises(HTTPException) as error:
+            await server.create_bill(BillCreate(customer_id=customer.id, items=[{"product_id": product.id, "quantity": 1}]), "main")
+        assert error.value.status_code == 404
+    run(scenario())
+
+
+def test_cart_checkout_bills_its_holds_and_releases_them(db):
+    async def scenario():
+        product, customer = await add_product(db), await add_customer(db)
+        await hold(db, product, 3)
+        bill = await server.create_bill(BillCreate(customer_id=customer.id, cart_id="cart"), "main")
+        assert [(item.product_id, item.quantity) for item in bill.items] == [(product.id, 3)]
+        assert await quantity(db, product) == 47
+        assert await db.holds.count_documents({}) == 0
+    run(scenario())
+
+
+def test_concurrent_checkouts_of_one_cart_bill_it_once(db, monkeypatch):
+    read_holds = server.active_holds
+
+    async def slow_active_holds(query):
+        # Both checkouts read the holds before either one claims them
+        holds = await read_holds(query)
+        await asyncio.sleep(0.01)
+        return holds
+    monkeypatch.setattr(server, "active_holds", slow_active_holds)
+
+    async def scenario():
+        product, customer = await add_product(db), await add_customer(db)
+        await hold(db, product, 3)
+        checkout = BillCreate(customer_id=customer.id, cart_id="cart")
+        results = await asyncio.gather(
+            server.create_bill(checkout, "main"), server.create_bill(checkout, "main"), return_exceptions=True
+        )
+        assert sorted(type(result).__name__ for result in results) == ["Bill", "HTTPException"]
+        assert next(r for r in results if isinstance(r, HTTPException)).status_code == 409
+        assert await quantity(db, product) == 47
+        assert await db.bills.count_documents({}) == 1
+    run(scenario())
+
+
+def test_failed_cart_checkout_keeps_its_holds(db):
+    async def scenario():
+        product, customer = await add_product(db, quantity=5), await add_customer(db)
+        await hold(db, product, 3)
+        # Stock was adjusted below the hold after it was placed
+        await db.products.update_one({"id": product.id}, {"$set": {"quantity": 2}})
+        with pytest.raises(HTTPException):
+            await server.create_bill(BillCreate(customer_id=customer.id, cart_id="cart"), "main")
+        assert await db.holds.count_documents({"cart_id": "cart"}) == 1
+        assert await quantity(db, product) == 2
+    run(scenario())
+
+
+def test_empty_cart_is_rejected(db):
+    async def scenario():
+        customer = await add_customer(db)
+        with pytest.raises(HTTPException) as error:
+            await server.create_bill(BillCreate(customer_id=customer.id, cart_id="cart"), "main")
+        assert error.value.status_code == 409
+    run(scenario())
+
+
+@pytest.mark.parametrize("q, digits, numbers", [
+    ("INF-NORTH-12", "12", ["INF-NORTH-12", "INF-NORTH-00012"]),
+    ("inf 00042", "00042", ["INF 00042", "INF-NORTH-00042"]),
+    ("0001", "0001", ["0001", "INF-NORTH-00001"]),
+    ("0771 234", "0771234", ["0771 234", "INF-NORTH-771234"]),
+])
+def test_number_queries_look_up_bill_numbers(q, digits, numbers):
+    assert server.bill_search_digits(q) == digits
+    assert server.bill_search_numbers("north", q, digits) == numbers
+
+
+@pytest.mark.parametrize("q", ["atlas", "INF-", "²", "١٢٣", "12a", "1" * 19, "9" * 5000])
+def test_other_queries_are_text_searches(q):
+    assert server.bill_search_digits(q) is None
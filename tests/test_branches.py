@@ -0,0 +1,25 @@
+import asyncio
+
+import server
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_documents_without_a_branch_join_the_default_branch(db):
+    async def scenario():
+        await db.bills.insert_many([{"id": "old"}, {"id": "new", "branch_id": "north"}])
+        await server.ensure_branch_fields()
+        bills = {bill["id"]: bill["branch_id"] for bill in await db.bills.find({}).to_list(None)}
+        assert bills == {"old": server.DEFAULT_BRANCH, "new": "north"}
+    run(scenario())
+
+
+def test_the_backfill_runs_once(db):
+    async def scenario():
+        await server.ensure_branch_fields()
+        await db.stock_movements.insert_one({"id": "m"})
+        await server.ensure_branch_fields()
+        assert "branch_id" not in await db.stock_movements.find_one({"id": "m"})
+    run(scenario())
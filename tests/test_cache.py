@@ -0,0 +1,171 @@
+import asyncio
+
+from server import EventBroker, InvalidationBus, VersionedCache
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def counting_loader(values):
+    calls = []
+
+    async def load():
+        calls.append(1)
+        return values[len(calls) - 1]
+    return load, calls
+
+
+def enabled_cache(**kwargs):
+    cache = VersionedCache(**kwargs)
+    cache.enabled = True
+    return cache
+
+
+def test_hits_until_invalidated():
+    cache = enabled_cache()
+    load, calls = counting_loader(["v1", "v2"])
+
+    async def scenario():
+        assert await cache.get("products", "main", load) == "v1"
+        assert await cache.get("products", "main", load) == "v1"
+        cache.invalidate("products", "main")
+        assert await cache.get("products", "main", load) == "v2"
+    run(scenario())
+    assert len(calls) == 2
+
+
+def test_scope_invalidation_covers_every_key():
+    cache = enabled_cache()
+    load, calls = counting_loader(["a", "b", "a2", "b2"])
+
+    async def scenario():
+        await cache.get("users", "alice", load)
+        await cache.get("users", "bob", load)
+        cache.invalidate("users")
+        assert await cache.get("users", "alice", load) == "a2"
+        assert await cache.get("users", "bob", load) == "b2"
+    run(scenario())
+
+
+def test_load_in_flight_during_invalidation_is_not_stored():
+    cache = enabled_cache()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_load():
+            await release.wait()
+            return "stale"
+
+        async def fresh_load():
+            return "fresh"
+
+        pending = asyncio.create_task(cache.get("products", "main", slow_load))
+        await asyncio.sleep(0)
+        cache.invalidate("products", "main")
+        release.set()
+        # The caller that started first still gets its own result...
+        assert await pending == "stale"
+        # ...but it was never cached for anyone else
+        assert await cache.get("products", "main", fresh_load) == "fresh"
+    run(scenario())
+
+
+def test_clear_during_load_is_not_stored():
+    cache = enabled_cache()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_load():
+            await release.wait()
+            return "stale"
+
+        pending = asyncio.create_task(cache.get("categories", None, slow_load))
+        await asyncio.sleep(0)
+        cache.clear()
+        release.set()
+        await pending
+    run(scenario())
+    assert not cache._entries
+
+
+def test_disabled_cache_always_loads():
+    cache = VersionedCache()
+    load, calls = counting_loader(["a", "b"])
+
+    async def scenario():
+        assert await cache.get("users", "alice", load) == "a"
+        assert await cache.get("users", "alice", load) == "b"
+    run(scenario())
+
+
+def test_entries_are_bounded_least_recently_used_first():
+    cache = enabled_cache(max_entries=2)
+
+    async def value(key):
+        async def load():
+            return key
+        return await cache.get("users", key, load)
+
+    async def scenario():
+        await value("a")
+        await value("b")
+        await value("a")
+        await value("c")
+    run(scenario())
+    assert list(cache._entries) == [("users", "a"), ("users", "c")]
+
+
+def test_misses_expire():
+    cache = enabled_cache()
+    load, calls = counting_loader([None, None])
+
+    async def scenario():
+        await cache.get("users", "nobody", load, miss_ttl=0)
+        await cache.get("users", "nobody", load, miss_ttl=0)
+    run(scenario())
+    assert len(calls) == 2
+
+
+def test_key_generations_are_bounded_without_serving_stale_loads():
+    cache = enabled_cache(max_entries=2)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_load():
+            await release.wait()
+            return "stale"
+
+        pending = asyncio.create_task(cache.get("users", "alice", slow_load))
+        await asyncio.sleep(0)
+        for key in ("alice", "x", "y", "z"):
+            cache.invalidate("users", key)
+        release.set()
+        await pending
+    run(scenario())
+    assert len(cache._generations) <= 2
+    assert ("users", "alice") not in cache._entries
+
+
+def bus():
+    return InvalidationBus(enabled_cache(), EventBroker(buffer_size=10, queue_size=10))
+
+
+def test_bus_applies_invalidations_in_sequence():
+    invalidations = bus()
+    invalidations.cache._entries[("users", "alice")] = (invalidations.cache._version("users", "alice"), "cached", None)
+    invalidations._apply({"seq": 1, "scope": "users", "key": "alice"})
+    assert invalidations.last_seq == 1
+    version = invalidations.cache._version("users", "alice")
+    assert invalidations.cache._entries[("users", "alice")][0] != version
+
+
+def test_bus_clears_the_cache_on_a_gap():
+    invalidations = bus()
+    invalidations.cache._entries[("products", "main")] = (invalidations.cache._version("products", "main"), "cached", None)
+    invalidations._apply({"seq": 3, "scope": "categories", "key": None})
+    assert invalidations.last_seq == 3
+    assert not invalidations.cache._entries
@@ -0,0 +1,94 @@
+import asyncio
+
+from server import EventBroker, encode_event
+
+
+def broker(buffer_size=10, queue_size=10):
+    return EventBroker(buffer_size=buffer_size, queue_size=queue_size)
+
+
+def publish(events, first_id, count, branch_id="main"):
+    for event_id in range(first_id, first_id + count):
+        events.dispatch(event_id, branch_id, "stats", {"n": event_id})
+
+
+def frame(event_id):
+    return encode_event(event_id, "stats", {"n": event_id})
+
+
+def test_new_subscriber_needs_a_snapshot():
+    events = broker()
+    publish(events, 1, 3)
+    queue, missed = events.subscribe("main")
+    assert missed is None
+
+
+def test_resume_returns_frames_after_last_event_id():
+    events = broker()
+    publish(events, 1, 5)
+    queue, missed = events.subscribe("main", 3)
+    assert missed == [frame(4), frame(5)]
+
+
+def test_resume_at_latest_event_misses_nothing():
+    events = broker()
+    publish(events, 1, 3)
+    queue, missed = events.subscribe("main", 3)
+    assert missed == []
+
+
+def test_resume_from_evicted_or_unknown_id_resyncs():
+    events = broker(buffer_size=3)
+    publish(events, 1, 6)
+    assert events.subscribe("main", 2)[1] is None
+    # Only ids the buffer holds count: one from before a restart does not
+    assert events.subscribe("main", 99)[1] is None
+
+
+def test_resume_follows_delivery_order_not_id_order():
+    # Ids come from a shared counter, so another worker's message can arrive
+    # with a lower id after a higher one; every worker sees the same order
+    events = broker()
+    for event_id in (1, 3, 2, 4):
+        events.dispatch(event_id, "main", "stats", {"n": event_id})
+    queue, missed = events.subscribe("main", 3)
+    assert missed == [frame(2), frame(4)]
+
+
+def test_resume_only_replays_own_and_shared_events():
+    events = broker()
+    events.dispatch(1, "main", "stats", {"n": 1})
+    events.dispatch(2, "kandy", "stats", {"n": 2})
+    events.dispatch(3, None, "stats", {"n": 3})
+    queue, missed = events.subscribe("main", 1)
+    assert missed == [frame(3)]
+
+
+def test_dispatch_reaches_subscribers_of_the_branch():
+    events = broker()
+    main, _ = events.subscribe("main")
+    kandy, _ = events.subscribe("kandy")
+    events.dispatch(1, "main", "stats", {"n": 1})
+    events.dispatch(2, None, "stats", {"n": 2})
+    assert [main.get_nowait() for _ in range(main.qsize())] == [frame(1), frame(2)]
+    assert [kandy.get_nowait() for _ in range(kandy.qsize())] == [frame(2)]
+    assert events.last_id == 2
+
+
+def test_slow_subscriber_is_dropped():
+    events = broker(queue_size=2)
+    slow, _ = events.subscribe("main")
+    publish(events, 1, 3)
+    # Its queue is emptied and closed with None; it resumes with Last-Event-ID
+    assert slow.get_nowait() is None
+    publish(events, 4, 1)
+    assert slow.empty()
+
+
+def test_reset_closes_streams_and_forgets_positions():
+    events = broker()
+    queue, _ = events.subscribe("main")
+    publish(events, 1, 2)
+    events.reset()
+    assert asyncio.run(asyncio.wait_for(queue.get(), 1)) is None
+    assert events.subscribe("main", 2)[1] is None
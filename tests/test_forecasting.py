@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forecasting import compute_reorder_suggestions, daily_demand_matrix
+
+END = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+
+
+def products(*rows):
+    return pd.DataFrame(rows, columns=["id", "name", "quantity"])
+
+
+def sales(*rows):
+    return pd.DataFrame(rows, columns=["product_id", "day", "quantity"])
+
+
+def test_demand_matrix_ignores_unknown_products_and_days():
+    days = pd.date_range(end="2024-02-29", periods=3, freq="D")
+    matrix = daily_demand_matrix(
+        sales(("a", "2024-02-29", 2), ("a", "2024-02-29", 3), ("b", "2024-02-28", 1),
+              ("zz", "2024-02-29", 9), ("a", "2023-01-01", 9)),
+        pd.Index(["a", "b"]),
+        days,
+    )
+    assert matrix.tolist() == [[0, 0, 5], [0, 1, 0]]
+
+
+def test_steady_demand():
+    # Two units a day for the whole window, every day the same
+    history = [("a", day.strftime("%Y-%m-%d"), 2) for day in pd.date_range(end="2024-02-29", periods=28, freq="D")]
+    result = compute_reorder_suggestions(products(("a", "Atlas", 10)), sales(*history), END, history_days=28,
+                                         lead_time_days=7, review_days=7, service_z=1.65).iloc[0]
+    assert result["velocity"] == 2
+    assert result["forecast_daily_demand"] == 2
+    assert result["days_of_cover"] == 5
+    # No variation, so no safety stock: 7 days of demand
+    assert result["reorder_point"] == 14
+    assert result["suggested_order_quantity"] == 2 * 14 - 10
+    assert result["needs_reorder"]
+
+
+def test_recent_week_weighs_more():
+    history = [("a", "2024-02-29", 28)]
+    result = compute_reorder_suggestions(products(("a", "Atlas", 100)), sales(*history), END, history_days=28).iloc[0]
+    assert result["demand_ma_7"] == 4
+    assert result["demand_ma_28"] == 1
+    assert result["forecast_daily_demand"] == pytest.approx(0.6 * 4 + 0.4 * 1)
+
+
+def test_products_without_sales():
+    result = compute_reorder_suggestions(products(("a", "Atlas", 0), ("b", "Bible", 5)), sales(), END).set_index("product_id")
+    assert np.isinf(result.loc["b", "days_of_cover"])
+    assert result["suggested_order_quantity"].tolist() == [0, 0]
+    assert not result["needs_reorder"].any()
+
+
+def test_sales_on_the_end_day_are_excluded():
+    result = compute_reorder_suggestions(products(("a", "Atlas", 5)), sales(("a", "2024-03-01", 50)), END).iloc[0]
+    assert result["velocity"] == 0
@@ -0,0 +1,128 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+from server import Job, JobRunner
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def runner():
+    """A JobRunner without the process pool or heartbeat loop of start()"""
+    job_runner = JobRunner()
+    job_runner._slots = asyncio.Semaphore(1)
+    started = asyncio.Event()
+
+    @job_runner.register("wait")
+    async def wait(job, params):
+        started.set()
+        while True:
+            await job.progress(0.5, "waiting")
+            await asyncio.sleep(0.01)
+
+    @job_runner.register("quick")
+    async def quick(job, params):
+        return None
+
+    @job_runner.register("broken")
+    async def broken(job, params):
+        raise ValueError("no such product")
+
+    return job_runner, started
+
+
+async def add_job(db, job_type, ago=timedelta(0), status="queued", worker="here"):
+    job = Job(type=job_type, created_by="admin", status=status, worker=worker, heartbeat_at=datetime.now(timezone.utc) - ago)
+    await db.jobs.insert_one(server.prepare_for_mongo(job.dict()))
+    return job
+
+
+async def status(db, job):
+    return (await db.jobs.find_one({"id": job.id}))["status"]
+
+
+def test_jobs_finish_with_their_outcome(db):
+    async def scenario():
+        job_runner, _ = runner()
+        quick, broken = await add_job(db, "quick"), await add_job(db, "broken")
+        job_runner.submit(quick.id, "quick", {})
+        job_runner.submit(broken.id, "broken", {})
+        await asyncio.gather(*job_runner._tasks.values())
+        assert await status(db, quick) == "succeeded"
+        failed = await db.jobs.find_one({"id": broken.id})
+        assert (failed["status"], failed["error"]) == ("failed", "no such product")
+        assert job_runner._tasks == {}
+    run(scenario())
+
+
+def test_cancelling_a_running_job_stops_it(db):
+    async def scenario():
+        job_runner, started = runner()
+        job = await add_job(db, "wait")
+        job_runner.submit(job.id, "wait", {})
+        task = job_runner._tasks[job.id]
+        await started.wait()
+        await job_runner.cancel(job.id)
+        await task
+        assert await status(db, job) == "cancelled"
+    run(scenario())
+
+
+def test_a_job_cancelled_by_another_worker_stops_at_its_next_progress(db):
+    async def scenario():
+        job_runner, started = runner()
+        job = await add_job(db, "wait")
+        job_runner.submit(job.id, "wait", {})
+        task = job_runner._tasks[job.id]
+        await started.wait()
+        await JobRunner().cancel(job.id)
+        await asyncio.wait_for(task, 1)
+        assert await status(db, job) == "cancelled"
+    run(scenario())
+
+
+def test_a_queued_job_cancelled_before_it_starts_never_runs(db):
+    async def scenario():
+        job_runner, started = runner()
+        job = await add_job(db, "wait")
+        await job_runner.cancel(job.id)
+        job_runner.submit(job.id, "wait", {})
+        await job_runner._tasks[job.id]
+        assert not started.is_set()
+        assert await status(db, job) == "cancelled"
+    run(scenario())
+
+
+def test_orphaned_jobs_are_cancelled_directly(db):
+    async def scenario():
+        orphan = await add_job(db, "wait", ago=timedelta(seconds=server.JOB_STALE_SECONDS * 2), status="running", worker="gone")
+        alive = await add_job(db, "wait", status="running", worker="elsewhere")
+        await JobRunner().cancel(orphan.id)
+        await JobRunner().cancel(alive.id)
+        assert await status(db, orphan) == "cancelled"
+        # The live worker picks the request up itself
+        kept = await db.jobs.find_one({"id": alive.id})
+        assert (kept["status"], kept["cancel_requested"]) == ("running", True)
+    run(scenario())
+
+
+def test_the_heartbeat_fails_orphans_and_keeps_its_own_jobs_alive(db):
+    async def scenario():
+        job_runner, started = runner()
+        stale = timedelta(seconds=server.JOB_STALE_SECONDS * 2)
+        orphan = await add_job(db, "wait", ago=stale, status="running", worker="gone")
+        own = await add_job(db, "wait", ago=stale)
+        job_runner.submit(own.id, "wait", {})
+        await started.wait()
+
+        heartbeat = asyncio.create_task(job_runner._beat())
+        await asyncio.sleep(0.05)
+        heartbeat.cancel()
+        assert await status(db, own) == "running"
+        await job_runner.stop()
+
+        failed = await db.jobs.find_one({"id": orphan.id})
+        assert (failed["status"], failed["error"]) == ("failed", "The worker running this job stopped before it finished")
+    run(scenario())
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from server import TokenBucketLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_then_retry_after(clock):
+    limiter = TokenBucketLimiter(rate_per_minute=6, burst=3, max_keys=10)
+    assert [limiter.acquire("alice") for _ in range(3)] == [0, 0, 0]
+    # One token every ten seconds
+    assert limiter.acquire("alice") == pytest.approx(10)
+
+
+def test_tokens_refill_over_time(clock):
+    limiter = TokenBucketLimiter(rate_per_minute=6, burst=2, max_keys=10)
+    limiter.acquire("alice")
+    limiter.acquire("alice")
+    clock.now += 5
+    assert limiter.acquire("alice") == pytest.approx(5)
+    clock.now += 5
+    assert limiter.acquire("alice") == 0
+
+
+def test_refill_stops_at_burst(clock):
+    limiter = TokenBucketLimiter(rate_per_minute=60, burst=2, max_keys=10)
+    limiter.acquire("alice")
+    clock.now += 3600
+    assert [limiter.acquire("alice") for _ in range(2)] == [0, 0]
+    assert limiter.acquire("alice") > 0
+
+
+def test_keys_are_independent(clock):
+    limiter = TokenBucketLimiter(rate_per_minute=1, burst=1, max_keys=10)
+    assert limiter.acquire("alice") == 0
+    assert limiter.acquire("alice") > 0
+    assert limiter.acquire("bob") == 0
+
+
+def test_least_recently_used_keys_are_dropped(clock):
+    limiter = TokenBucketLimiter(rate_per_minute=1, burst=1, max_keys=2)
+    limiter.acquire("alice")
+    limiter.acquire("bob")
+    limiter.acquire("alice")
+    limiter.acquire("carol")
+    assert list(limiter._buckets) == ["alice", "carol"]
+    # A dropped key comes back with a full bucket
+    assert limiter.acquire("bob") == 0
+
+
+def request(peer, forwarded=None):
+    headers = {"x-forwarded-for": forwarded} if forwarded else {}
+    return SimpleNamespace(client=SimpleNamespace(host=peer), headers=headers)
+
+
+@pytest.fixture
+def trusted(monkeypatch):
+    monkeypatch.setattr(server, "TRUSTED_PROXIES", [server.ipaddress.ip_network("10.0.0.0/8")])
+
+
+def test_forwarded_header_from_untrusted_peer_is_ignored(trusted):
+    assert server.client_address(request("203.0.113.7", "198.51.100.1")) == "203.0.113.7"
+
+
+def test_client_behind_trusted_proxies(trusted):
+    # A spoofed first hop is skipped: the nearest untrusted hop is the client
+    assert server.client_address(request("10.0.0.2", "192.0.2.1, 198.51.100.1, 10.0.0.5")) == "198.51.100.1"
+
+
+def test_trusted_proxy_without_forwarded_header(trusted):
+    assert server.client_address(request("10.0.0.2")) == "10.0.0.2"
+
+
+def test_no_trusted_proxies_by_default():
+    assert server.client_address(request("10.0.0.2", "198.51.100.1")) == "10.0.0.2"
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime, timezone
+
+import server
+from reports import RECEIPT_TEMPLATE_VERSION, render_receipt
+from server import Bill, BillItem
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def bill(customer_name="Amal Perera"):
+    return Bill(
+        bill_number="INF-00042",
+        customer_id="c",
+        customer_name=customer_name,
+        customer_contact="0771234567",
+        date=datetime(2024, 3, 1, 14, 30, tzinfo=timezone.utc),
+        items=[BillItem(product_id="p", product_name="Atlas <Deluxe>", quantity=2, price=1250.0, subtotal=2500.0)],
+        total=2500.0
+    ).dict()
+
+
+def test_html_receipts_list_the_bill_and_escape_its_text():
+    receipt = render_receipt(bill(), "html").decode("utf-8")
+    assert "INF-00042" in receipt
+    assert "March 01, 2024" in receipt and "02:30 PM" in receipt
+    assert "Atlas &lt;Deluxe&gt;" in receipt and "<Deluxe>" not in receipt
+    assert "2,500.00" in receipt
+
+
+def test_receipts_render_stored_bills_with_iso_dates():
+    stored = server.prepare_for_mongo(bill())
+    assert render_receipt(stored, "html") == render_receipt(bill(), "html")
+
+
+def test_pdf_receipts_render_names_outside_latin1():
+    receipt = render_receipt(bill(customer_name="අමල් පෙරේරා"), "pdf")
+    assert receipt.startswith(b"%PDF")
+
+
+def test_cache_keys_change_with_the_format_and_template():
+    assert server.receipt_cache_key("b", "html") == f"b:html:v{RECEIPT_TEMPLATE_VERSION}"
+    assert server.receipt_cache_key("b", "html") != server.receipt_cache_key("b", "pdf")
+
+
+def test_receipts_are_rendered_once_per_format(db, monkeypatch):
+    rendered = []
+    def counting_render(bill, format):
+        rendered.append((bill["id"], format))
+        return render_receipt(bill, format)
+    monkeypatch.setattr(server, "render_receipt", counting_render)
+
+    async def scenario():
+        bills = [server.prepare_for_mongo(bill()), server.prepare_for_mongo(bill())]
+        first = await server.cached_receipts(bills, "html")
+        second = await server.cached_receipts(bills, "html")
+        assert first == second
+        assert sorted(rendered) == sorted((b["id"], "html") for b in bills)
+        await server.cached_receipts(bills[:1], "pdf")
+        assert len(rendered) == 3
+    run(scenario())
+
+
+def test_receipt_route_answers_a_matching_etag_with_not_modified(db):
+    async def scenario():
+        stored = server.prepare_for_mongo(bill())
+        await db.bills.insert_one(dict(stored))
+        response = await server.get_bill_receipt(stored["id"], "html", None, "main")
+        assert response.status_code == 200
+        assert response.headers["etag"] == f'"{server.receipt_cache_key(stored["id"], "html")}"'
+        again = await server.get_bill_receipt(stored["id"], "html", response.headers["etag"], "main")
+        assert again.status_code == 304
+    run(scenario())
@@ -0,0 +1,40 @@
+import asyncio
+
+import server
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def add_products(db, count):
+    return db.products.insert_many([
+        {"id": f"p{index}", "name": f"Product {index}", "quantity": 10, "branch_id": "main"}
+        for index in range(count)
+    ])
+
+
+def test_concurrent_runs_keep_one_batch_of_suggestions(db):
+    async def scenario():
+        await add_products(db, 3)
+        # Runs started together share their timestamp to the second
+        await asyncio.gather(server.run_demand_forecast(), server.run_demand_forecast())
+        current = await server.latest_forecast_run()
+        suggestions = await db.reorder_suggestions.find({}).to_list(None)
+        assert len(suggestions) == 3
+        assert {suggestion["run_id"] for suggestion in suggestions} == {current["run_id"]}
+        report = await server.get_reorder_suggestions(all=True, branch_id="main")
+        assert len(report.suggestions) == 3
+    run(scenario())
+
+
+def test_refresh_queues_a_forecast_job(db, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(server.job_runner, "submit", lambda *job: submitted.append(job))
+    async def scenario():
+        job = await server.refresh_reorder_suggestions("admin", "north")
+        assert (job.type, job.branch_id) == ("demand_forecast", "north")
+        assert await db.jobs.count_documents({"id": job.id}) == 1
+        assert await db.reorder_suggestions.count_documents({}) == 0
+    run(scenario())
+    assert submitted == [(submitted[0][0], "demand_forecast", {"branch_id": "north"})]
@@ -0,0 +1,66 @@
+import asyncio
+
+from server import SlowQueryLog, _command_filter, redact_filter
+
+
+def test_values_are_redacted_but_shape_is_kept():
+    query = {"branch_id": "main", "date": {"$gte": "2024-01-01", "$lt": "2024-02-01"}, "total": 1500}
+    assert redact_filter(query) == {"branch_id": "?", "date": {"$gte": "?", "$lt": "?"}, "total": "?"}
+
+
+def test_lists_keep_one_entry_per_distinct_shape():
+    query = {"id": {"$in": ["a", "b", "c"]}, "$or": [{"bill_number": "INF-1"}, {"bill_number": "INF-2"}, {"customer_contact": "07"}]}
+    assert redact_filter(query) == {"id": {"$in": ["?"]}, "$or": [{"bill_number": "?"}, {"customer_contact": "?"}]}
+
+
+def test_pipelines_are_redacted():
+    pipeline = [{"$match": {"date": {"$gte": "2024"}}}, {"$group": {"_id": "$product_id", "n": {"$sum": 1}}}]
+    assert redact_filter(pipeline) == [{"$match": {"date": {"$gte": "?"}}}, {"$group": {"_id": "?", "n": {"$sum": "?"}}}]
+
+
+def test_scalars_and_empty_values():
+    assert redact_filter("secret") == "?"
+    assert redact_filter({}) == {}
+    assert redact_filter([]) == []
+
+
+def test_command_filters():
+    assert _command_filter("find", {"filter": {"id": 1}}) == {"id": 1}
+    assert _command_filter("update", {"updates": [{"q": {"id": 1}}, {"q": {"id": 2}}]}) == [{"id": 1}, {"id": 2}]
+    assert _command_filter("insert", {"documents": []}) is None
+
+
+class FakeSettings:
+    def __init__(self, stored=None):
+        self.stored = stored
+
+    async def find_one(self, query):
+        return self.stored
+
+    async def find_one_and_update(self, query, update, **kwargs):
+        self.stored = {**(self.stored or {"_id": query["_id"]}), **update["$set"]}
+        return self.stored
+
+
+class FakeDatabase:
+    def __init__(self, stored=None):
+        self.settings = FakeSettings(stored)
+
+
+def test_shared_settings_override_environment_defaults():
+    log = SlowQueryLog()
+    asyncio.run(log.load(FakeDatabase({"_id": SlowQueryLog.SETTINGS_ID, "threshold_ms": 250.0, "enabled": False})))
+    assert log.threshold_ms == 250.0
+    assert log.enabled is False
+
+
+def test_update_is_stored_and_applied():
+    log = SlowQueryLog()
+    database = FakeDatabase()
+    asyncio.run(log.update(database, {"sample_rate": 0.25}))
+    assert database.settings.stored["sample_rate"] == 0.25
+    assert log.settings()["sample_rate"] == 0.25
+    # Another worker picks it up from the store
+    other = SlowQueryLog()
+    asyncio.run(other.load(database))
+    assert other.settings() == log.settings()
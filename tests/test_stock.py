@@ -0,0 +1,142 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import BillCreate, Category, Customer, Product, ProductCreate, ProductUpdate, StockMovement
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture(autouse=True)
+def no_lag(monkeypatch):
+    # Snapshot right up to now so the tests need not wait out the lag
+    monkeypatch.setattr(server, "STOCK_SNAPSHOT_LAG_SECONDS", 0)
+
+
+async def add_product(db, quantity=20):
+    """A product written straight to the collection, as seed data and imports do"""
+    product = Product(name="Atlas", category_id="c", category_name="Maps", price=100.0, quantity=quantity)
+    await db.products.insert_one(server.prepare_for_mongo(product.dict()))
+    return product
+
+
+async def move(product, delta, ago, reason="sale"):
+    await server.record_stock_movements([StockMovement(
+        product_id=product.id,
+        delta=delta,
+        reason=reason,
+        created_at=datetime.now(timezone.utc) - ago
+    )])
+
+
+async def openings(db, product):
+    return await db.stock_movements.count_documents({"product_id": product.id, "reason": {"$in": ["opening", "initial"]}})
+
+
+async def level(product):
+    return (await server.stock_level_at(product.id, datetime.now(timezone.utc))).quantity
+
+
+def test_products_sold_before_the_first_run_keep_their_stock(db):
+    async def scenario():
+        product = await add_product(db, quantity=15)
+        await move(product, -5, timedelta(minutes=10))
+        await server.take_stock_snapshot()
+        assert await level(product) == 15
+        opening = await db.stock_movements.find_one({"product_id": product.id, "reason": "opening"})
+        assert opening["delta"] == 20
+        # Dated before the sale, so past levels never go negative
+        past = await server.stock_level_at(product.id, datetime.now(timezone.utc) - timedelta(minutes=5))
+        assert past.quantity == 15
+    run(scenario())
+
+
+def test_products_added_after_the_first_run_get_an_opening(db):
+    async def scenario():
+        await server.take_stock_snapshot()
+        product = await add_product(db, quantity=12)
+        await server.take_stock_snapshot()
+        assert await openings(db, product) == 1
+        assert await level(product) == 12
+    run(scenario())
+
+
+def test_openings_are_written_once(db):
+    async def scenario():
+        product = await add_product(db)
+        await asyncio.gather(server.take_stock_snapshot_now(), server.take_stock_snapshot_now())
+        await server.take_stock_snapshot()
+        assert await openings(db, product) == 1
+        assert await level(product) == 20
+    run(scenario())
+
+
+def test_snapshots_taken_before_the_backfill_are_corrected(db):
+    async def scenario():
+        product = await add_product(db, quantity=15)
+        await move(product, -5, timedelta(minutes=10))
+        # An earlier run snapshotted the sale without an opening balance
+        as_of = datetime.now(timezone.utc) - timedelta(minutes=5)
+        await db.stock_snapshots.insert_one({"product_id": product.id, "quantity": -5, "as_of": as_of})
+        await db.stock_snapshot_runs.insert_one({"as_of": as_of, "products": 1})
+        await server.take_stock_snapshot()
+        assert await level(product) == 15
+        snapshot = await db.stock_snapshots.find_one({"product_id": product.id, "as_of": as_of})
+        assert snapshot["quantity"] == 15
+    run(scenario())
+
+
+def test_stock_level_reads_the_latest_snapshot_before_the_time_plus_the_tail(db):
+    async def scenario():
+        product = await add_product(db, quantity=0)
+        await move(product, 10, timedelta(minutes=30), reason="initial")
+        await move(product, -2, timedelta(minutes=20))
+        snapshot = (datetime.now(timezone.utc) - timedelta(minutes=15)).replace(microsecond=0)
+        await db.stock_snapshots.insert_one({"product_id": product.id, "quantity": 8, "as_of": snapshot})
+        await move(product, -3, timedelta(minutes=10))
+
+        now = await server.stock_level_at(product.id, datetime.now(timezone.utc))
+        assert (now.quantity, now.snapshot_as_of, now.movements_applied) == (5, snapshot, 1)
+        before = await server.stock_level_at(product.id, datetime.now(timezone.utc) - timedelta(minutes=25))
+        assert (before.quantity, before.snapshot_as_of, before.movements_applied) == (10, None, 1)
+    run(scenario())
+
+
+def test_manual_snapshots_wait_for_the_lease(db):
+    async def scenario():
+        await db.leases.insert_one({"_id": "stock_snapshot", "owner": "other-worker", "expires_at": datetime.now(timezone.utc) + timedelta(minutes=5)})
+        with pytest.raises(HTTPException) as error:
+            await server.create_stock_snapshot("admin")
+        assert error.value.status_code == 409
+        assert await db.stock_snapshot_runs.count_documents({}) == 0
+    run(scenario())
+
+
+def test_a_sale_during_a_product_update_does_not_drift_the_ledger(db, monkeypatch):
+    async def scenario():
+        maps, atlases = Category(name="Maps"), Category(name="Atlases")
+        await db.categories.insert_many([server.prepare_for_mongo(category.dict()) for category in (maps, atlases)])
+        await server.create_product(ProductCreate(name="Atlas", category_id=maps.id, price=100.0, quantity=50), "main")
+        [product] = await db.products.find({}).to_list(None)
+        customer = Customer(name="Amal Perera", contact="0771234567")
+        await db.customers.insert_one(server.prepare_for_mongo(customer.dict()))
+
+        # A checkout lands while the update is looking up its category
+        collection = type(db.categories)
+        find_one = collection.find_one
+        async def find_one_during_a_sale(self, *args, **kwargs):
+            if self.name == "categories":
+                await server.create_bill(BillCreate(customer_id=customer.id, items=[{"product_id": product["id"], "quantity": 3}]), "main")
+            return await find_one(self, *args, **kwargs)
+        monkeypatch.setattr(collection, "find_one", find_one_during_a_sale)
+
+        await server.update_product(product["id"], ProductUpdate(quantity=60, category_id=atlases.id), "admin", "main")
+        movements = await db.stock_movements.find({"product_id": product["id"]}).to_list(None)
+        assert sum(movement["delta"] for movement in movements) == 60
+        assert (await db.products.find_one({"id": product["id"]}))["quantity"] == 60
+    run(scenario())